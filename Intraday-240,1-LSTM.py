@@ -1,11 +1,17 @@
-import pandas as pd
 import numpy as np
 import random
 import time
-import pickle
-from sklearn.preprocessing import OneHotEncoder
 from sklearn.preprocessing import RobustScaler
 from Statistics import Statistics
+from features import panel, shift, intraday_returns, window_family, build_samples
+from samples import SampleStore
+from cache import FeatureCache
+from backtest import backtest
+from shared_data import load_constituents, load_prices, window, intraday_label
+from outputs import atomic_open, atomic_path
+from prediction_store import save_predictions
+import instrument
+from lstm_input import scale, spill, stream
 
 import tensorflow as tf
 from tensorflow.keras.layers import LSTM, Dropout,Dense,Input,add
@@ -16,26 +22,19 @@ import warnings
 warnings.filterwarnings("ignore")
 
 import os
+import sys
 SEED = 9
+# WARM_START=1 in the environment starts each year from the previous year's
+# model with a patience of WARM_PATIENCE epochs. Years then depend on each
+# other and must run serially; models and results go to the -warm folders.
+WARM_START = os.environ.get('WARM_START') == '1'
+WARM_PATIENCE = 3
 os.environ['PYTHONHASHSEED']=str(SEED)
 random.seed(SEED)
 np.random.seed(SEED)
 
 
-SP500_df = pd.read_csv('data/SPXconst.csv')
-all_companies = list(set(SP500_df.values.flatten()))
-#all_companies.remove(np.nan)
-
-constituents = {'-'.join(col.split('/')[::-1]):set(SP500_df[col].dropna()) 
-                for col in SP500_df.columns}
-
-constituents_train = {} 
-for test_year in range(1993,2016):
-    months = [str(t)+'-0'+str(m) if m<10 else str(t)+'-'+str(m) 
-              for t in range(test_year-3,test_year) for m in range(1,13)]
-    constituents_train[test_year] = [list(constituents[m]) for m in months]
-    constituents_train[test_year] = set([i for sublist in constituents_train[test_year] 
-                                         for i in sublist])
+constituents = load_constituents()
 
 def makeLSTM():
     inputs = Input(shape=(240,1))
@@ -44,75 +43,51 @@ def makeLSTM():
     x = Dropout(0.1)(x)
     outputs = Dense(2,activation='softmax')(x)
     model = Model(inputs=inputs, outputs=outputs)
-    model.compile(loss='categorical_crossentropy',optimizer=optimizers.RMSprop(),
+    model.compile(loss='sparse_categorical_crossentropy',optimizer=optimizers.RMSprop(),
                           metrics=['accuracy'])
     model.summary()
     return model
     
 
-def callbacks_req(model_type='LSTM'):
+def model_file(test_year,model_type='LSTM'):
+    return model_folder+'/model-'+model_type+'-'+str(test_year)+'.keras'
+
+def callbacks_req(test_year,model_type='LSTM',patience=10):
     csv_logger = CSVLogger(model_folder+'/training-log-'+model_type+'-'+str(test_year)+'.csv')
     filepath = model_folder+"/model-" + model_type + '-' + str(test_year) + "-E{epoch:02d}.keras" #Changed to kearas
 
     model_checkpoint = ModelCheckpoint(filepath, monitor='val_loss', save_best_only=False, save_freq='epoch')
 
 
-    earlyStopping = EarlyStopping(monitor='val_loss',mode='min',patience=10,restore_best_weights=True)
+    earlyStopping = EarlyStopping(monitor='val_loss',mode='min',patience=patience,restore_best_weights=True)
     return [csv_logger,earlyStopping,model_checkpoint]
 
-def reshaper(arr):
-    arr = np.array(np.split(arr,3,axis=1))
-    arr = np.swapaxes(arr,0,1)
-    arr = np.swapaxes(arr,1,2)
-    return arr
-
-def trainer(train_data, test_data, model_type='LSTM'):
-    np.random.shuffle(train_data)
-    train_x, train_y, train_ret = train_data[:, 2:-2], train_data[:, -1], train_data[:, -2]
-    train_x = np.reshape(train_x, (len(train_x), 240, 1))
-    train_y = np.reshape(train_y, (-1, 1))
-
-    enc = OneHotEncoder(handle_unknown='ignore')
-    enc.fit(train_y)
-    enc_y = enc.transform(train_y).toarray()
-
-    #Fix issues with varying data type, ENSURE float
-    train_x = np.nan_to_num(train_x).astype('float32')
-    enc_y = np.nan_to_num(enc_y).astype('float32')
-
+def trainer(train_data, test_data, test_year, model_type='LSTM'):
     if model_type == 'LSTM':
         model = makeLSTM()
     else:
         return
-
-    callbacks = callbacks_req(model_type)
-
-    model.fit(
-        train_x,
-        enc_y,
-        epochs=5,
-        validation_split=0.2,
-        callbacks=callbacks,
-        batch_size=512
-    )
-
-    dates = list(set(test_data[:, 0]))
-    predictions = {}
-
-    for day in dates:
-        test_d = test_data[test_data[:, 0] == day]
-        test_d = test_d[:, 2:-2]
-
-        # Handle NaN/infinite values and ensure numeric type
-        test_d = np.nan_to_num(test_d).astype('float32')
-
-        # Reshape test_d to 3D (required by LSTM model)
-        if test_d.ndim == 2:
-            test_d = np.reshape(test_d, (len(test_d), 240, 1))
-
-
-        # Make predictions
-        predictions[day] = model.predict(test_d)[:, 1]
+    patience = 10
+    if WARM_START and os.path.exists(model_file(test_year-1,model_type)):
+        # start from last year's best weights, with its own early-stopping budget
+        model.set_weights(load_model(model_file(test_year-1,model_type)).get_weights())
+        patience = WARM_PATIENCE
+
+    callbacks = callbacks_req(test_year,model_type,patience)
+
+    # batches stream from the memory-mapped features, see lstm_input
+    with instrument.stage('fit'):
+        model.fit(
+            epochs=5,
+            callbacks=callbacks,
+            **stream(train_data, validation_split=0.2, batch_size=512)
+        )
+        with atomic_path(model_file(test_year,model_type)) as tmp:
+            model.save(tmp)
+
+    # One pass over the whole test year, split back into days afterwards
+    with instrument.stage('predict'):
+        predictions = test_data.by_day(model.predict(test_data.x, batch_size=4096)[:, 1])
 
     return model, predictions
 
@@ -120,125 +95,126 @@ def trainer(train_data, test_data, model_type='LSTM'):
 def trained(filename, train_data, test_data):
     model = load_model(filename)
 
-    dates = list(set(test_data[:, 0]))
-    predictions = {}
-
-    for day in dates:
-        test_d = test_data[test_data[:, 0] == day]
-        test_d = test_d[:, 2:-2]
-
-        # Handle NaN/infinite values and ensure numeric type
-        test_d = np.nan_to_num(test_d).astype('float32')
-
-        # Reshape test_d to 3D (required by LSTM model)
-        if test_d.ndim == 2:
-            test_d = np.reshape(test_d, (len(test_d), 240, 1))
-
-
-
-        # Make predictions
-        predictions[day] = model.predict(test_d)[:, 1]
+    # One pass over the whole test year, split back into days afterwards
+    predictions = test_data.by_day(model.predict(test_data.x, batch_size=4096)[:, 1])
 
     return model, predictions
   
 
-def simulate(test_data,predictions):
-    rets = pd.DataFrame([],columns=['Long','Short'])
-    k = 10
-    for day in sorted(predictions.keys()):
-        preds = predictions[day]
-        test_returns = test_data[test_data[:,0]==day][:,-2]
-        top_preds = predictions[day].argsort()[-k:][::-1] 
-        trans_long = test_returns[top_preds]
-        worst_preds = predictions[day].argsort()[:k][::-1] 
-        trans_short = -test_returns[worst_preds]
-        rets.loc[day] = [np.mean(trans_long),np.mean(trans_short)] 
+def simulate(test_data,predictions,k=10):
+    dates,pred = test_data.matrix(test_data.from_days(predictions))
+    _,ret = test_data.matrix(test_data.ret)
+    rets = backtest(pred,ret,dates,[k])[k]
     print('Result : ',rets.mean())  
     return rets       
 
     
-def create_label(df_open,df_close,perc=[0.5,0.5]):
-    if not np.all(df_close.iloc[:,0]==df_open.iloc[:,0]):
-        print('Date Index issue')
-        return
-    perc = [0.]+list(np.cumsum(perc))
-    label = (df_close.iloc[:,1:]/df_open.iloc[:,1:]-1).apply(
-            lambda x: pd.qcut(x.rank(method='first'),perc,labels=False), axis=1)
-    return label[1:]
-
-def create_stock_data(df_open,df_close,st,m=240):
-    st_data = pd.DataFrame([])
-    st_data['Date'] = list(df_close['Date'])
-    st_data['Name'] = [st]*len(st_data)
-    daily_change = df_close[st]/df_open[st]-1
-    for k in range(m)[::-1]:
-        st_data['IntraR'+str(k)] = daily_change.shift(k)
-
-    st_data['IntraR-future'] = daily_change.shift(-1)    
-    st_data['label'] = list(label[st])+[np.nan] 
-    st_data['Month'] = list(df_close['Date'].str[:-3])
-    st_data = st_data.dropna()
-    
-    trade_year = st_data['Month'].str[:4]
-    st_data = st_data.drop(columns=['Month'])
-    st_train_data = st_data[trade_year<str(test_year)]
-    st_test_data = st_data[trade_year==str(test_year)]
-    return np.array(st_train_data),np.array(st_test_data) 
+def create_label(test_year,perc=[0.5,0.5]):
+    label = intraday_label(test_year,tuple(perc))
+    # row t is labelled with day t+1
+    return label.shift(-1)
+
+def create_features(df_open,df_close,stock_names,m=240):
+    op,cl = panel(df_open,stock_names),panel(df_close,stock_names)
+    return [window_family(intraday_returns(op,cl),m)]
+
+def create_returns(df_open,df_close,stock_names):
+    # R-future: the next day's intraday return
+    op,cl = panel(df_open,stock_names),panel(df_close,stock_names)
+    return shift(intraday_returns(op,cl),-1)
+
+def create_stock_data(df_open,df_close,label,stock_names,m=240):
+    X,t,j,future,lab = build_samples(create_features(df_open,df_close,stock_names,m),
+                                     create_returns(df_open,df_close,stock_names),
+                                     label[stock_names].to_numpy(dtype='float64'))
+    return SampleStore(X,t,j,future,lab,df_close['Date'],stock_names)
 
 def scalar_normalize(train_data,test_data):
-    scaler = RobustScaler()
-    scaler.fit(train_data[:,2:-2])
-    train_data[:,2:-2] = scaler.transform(train_data[:,2:-2])
-    test_data[:,2:-2] = scaler.transform(test_data[:,2:-2])
+    # RobustScaler over the (samples, 240*features) views, fitted and applied
+    # in place a chunk at a time (lstm_input.scale)
+    scale(train_data.x,test_data.x,RobustScaler)
     
 
-model_folder = 'models-Intraday-240-1-LSTM'
-result_folder = 'results-Intraday-240-1-LSTM'
+model_folder = 'models-Intraday-240-1-LSTM'+('-warm' if WARM_START else '')
+result_folder = 'results-Intraday-240-1-LSTM'+('-warm' if WARM_START else '')
 for directory in [model_folder,result_folder]:
     if not os.path.exists(directory):
         os.makedirs(directory)
-
-for test_year in range(1993,2020):
+strategy = 'Intraday-240-1-LSTM'
+feature_cache = FeatureCache('cache',strategy)
+prices = load_prices()
+
+def outputs(test_year):
+    # what run_year writes for a year; the runner skips years that have them
+    return [result_folder+'/avg_daily_rets-'+str(test_year)+'.csv',
+            result_folder+'/predictions-'+str(test_year)+'.npz',
+            model_file(test_year)]
+
+def run_year(test_year):
+    # every year starts from the same random state, so a year gives the
+    # same result run alone, serially or on the scheduler's pool
+    random.seed(SEED)
+    np.random.seed(SEED)
+    tf.random.set_seed(SEED)
     
     print('-'*40)
     print(test_year)
     print('-'*40)
     
-    filename = 'data/Open-'+str(test_year-3)+'.csv'
-    df_open = pd.read_csv(filename)
-    filename = 'data/Close-'+str(test_year-3)+'.csv'
-    df_close = pd.read_csv(filename)
+    instrument.begin(strategy,test_year)
+    with instrument.stage('load'):
+        df_open,df_close = window(test_year)
     
-    label = create_label(df_open,df_close)
-    stock_names = sorted(list(constituents[str(test_year-1)+'-12']))
-    train_data,test_data = [],[]
+    with instrument.stage('create_label'):
+        label = create_label(test_year)
+    stock_names = constituents.members(str(test_year-1)+'-12',df_close.columns)
 
     start = time.time()
-    for st in stock_names:
-        st_train_data,st_test_data = create_stock_data(df_open,df_close,st)
-        train_data.append(st_train_data)
-        test_data.append(st_test_data)
-        
-    train_data = np.concatenate([x for x in train_data])
-    test_data = np.concatenate([x for x in test_data])
-    
-    scalar_normalize(train_data,test_data)
-    print(train_data.shape,test_data.shape,time.time()-start)
-    
-    model,predictions = trainer(train_data,test_data)
-    returns = simulate(test_data,predictions)
-    returns.to_csv(result_folder+'/avg_daily_rets-'+str(test_year)+'.csv')
+    # the training features are assembled into a temporary memory-mapped
+    # file the trainer streams its batches from; it is removed once
+    # training is done
+    with spill(os.path.join('cache',strategy+'-train')) as target:
+        with instrument.stage('create_stock_data'):
+            # the years shared with other windows come from the feature cache
+            train_data = feature_cache.samples([df_open,df_close],label,stock_names,range(test_year-3,test_year),
+                                               create_features,create_returns,target.array)
+            test_data = feature_cache.samples([df_open,df_close],label,stock_names,[test_year],
+                                              create_features,create_returns)
+
+        with instrument.stage('normalize'):
+            scalar_normalize(train_data,test_data)
+        print(train_data.shape,test_data.shape,time.time()-start)
+
+        start = time.time()
+        model,predictions = trainer(train_data,test_data,test_year)
+    # epochs until early stopping, and the best of them, for the warm/cold comparison
+    epochs = len(model.history.history['loss'])
+    best = int(np.argmin(model.history.history['val_loss']))+1
+    train_time = time.time()-start
+    print('Epochs :',epochs,'best',best,'train time',train_time)
+    with instrument.stage('simulate'):
+        returns = simulate(test_data,predictions)
+    with instrument.stage('write'):
+        save_predictions(result_folder+'/predictions-'+str(test_year)+'.npz',test_data,
+                         test_data.from_days(predictions))
+        with atomic_open(result_folder+'/avg_daily_rets-'+str(test_year)+'.csv', newline='') as handle:
+            returns.to_csv(handle)
     
     result = Statistics(returns.sum(axis=1))
     print('\nAverage returns prior to transaction charges')
     result.shortreport() 
     
-    with open(result_folder+"/avg_returns.txt", "a") as myfile:
-        res = '-'*30 + '\n'
-        res += str(test_year) + '\n'
-        res += 'Mean = ' + str(result.mean()) + '\n'
-        res += 'Sharpe = '+str(result.sharpe()) + '\n'
-        res += '-'*30 + '\n'
-        myfile.write(res)
-        
-
+    instrument.end(result_folder)
+    res = '-'*30 + '\n'
+    res += str(test_year) + '\n'
+    res += 'Mean = ' + str(result.mean()) + '\n'
+    res += 'Sharpe = '+str(result.sharpe()) + '\n'
+    res += 'Epochs = ' + str(epochs) + ' (best ' + str(best) + ')\n'
+    res += 'Train time = ' + str(train_time) + '\n'
+    res += '-'*30 + '\n'
+    return res
+
+
+if __name__ == '__main__':
+    from scheduler import run
+    run(sys.modules[__name__])
@@ -1,41 +1,40 @@
-import pandas as pd
 import numpy as np
 import random
 import time
-import pickle
-from sklearn.preprocessing import OneHotEncoder
 from sklearn.preprocessing import StandardScaler,RobustScaler
 from Statistics import Statistics
+from features import panel, shift, close_returns, window_family, build_samples
+from samples import SampleStore
+from cache import FeatureCache
+from backtest import backtest
+from shared_data import load_constituents, load_prices, frame, nextday_label
+from outputs import atomic_open, atomic_path
+from prediction_store import save_predictions
+import instrument
+from lstm_input import scale, spill, stream
 
 import tensorflow as tf
 from tensorflow.keras.layers import CuDNNLSTM,LSTM,Dropout,Dense,Input 
 from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint, CSVLogger 
-from tensorflow.keras.models import Model, Sequential 
+from tensorflow.keras.models import Model, Sequential, load_model
 from tensorflow.keras import optimizers
 import warnings
 warnings.filterwarnings("ignore")
 
 import os
+import sys
 SEED = 9
+# WARM_START=1 in the environment starts each year from the previous year's
+# model with a patience of WARM_PATIENCE epochs. Years then depend on each
+# other and must run serially; models and results go to the -warm folders.
+WARM_START = os.environ.get('WARM_START') == '1'
+WARM_PATIENCE = 3
 os.environ['PYTHONHASHSEED']=str(SEED)
 random.seed(SEED)
 np.random.seed(SEED)
 tf.set_random_seed(SEED)
 
-SP500_df = pd.read_csv('data/SPXconst.csv')
-all_companies = list(set(SP500_df.values.flatten()))
-all_companies.remove(np.nan)
-
-constituents = {'-'.join(col.split('/')[::-1]):set(SP500_df[col].dropna()) 
-                for col in SP500_df.columns}
-
-constituents_train = {} 
-for test_year in range(1993,2016):
-    months = [str(t)+'-0'+str(m) if m<10 else str(t)+'-'+str(m) 
-              for t in range(test_year-3,test_year) for m in range(1,13)]
-    constituents_train[test_year] = [list(constituents[m]) for m in months]
-    constituents_train[test_year] = set([i for sublist in constituents_train[test_year] 
-                                         for i in sublist])
+constituents = load_constituents()
     
 def makeSimpleLSTM(cells=25):
     inputs = Input(shape=(sequence_length,1))
@@ -44,7 +43,7 @@ def makeSimpleLSTM(cells=25):
                    dropout=0.1,recurrent_dropout=0.1)(inputs)
     outputs = Dense(2,activation='softmax')(x)
     model = Model(inputs=inputs, outputs=outputs)
-    model.compile(loss='categorical_crossentropy',optimizer=optimizers.RMSprop(),
+    model.compile(loss='sparse_categorical_crossentropy',optimizer=optimizers.RMSprop(),
                           metrics=['accuracy'])
     model.summary()
     return model
@@ -55,161 +54,165 @@ def makeCuDNNLSTM(cells=25):
     x = Dropout(0.1)(x)
     outputs = Dense(2,activation='softmax')(x)
     model = Model(inputs=inputs, outputs=outputs)
-    model.compile(loss='categorical_crossentropy',optimizer=optimizers.RMSprop(),
+    model.compile(loss='sparse_categorical_crossentropy',optimizer=optimizers.RMSprop(),
                           metrics=['accuracy'])
     model.summary()
     return model  
 
-def callbacks_req(model_type='LSTM'):
+def model_file(test_year,model_type='LSTM'):
+    return model_folder+'/model-'+model_type+'-'+str(test_year)+'.h5'
+
+def callbacks_req(test_year,model_type='LSTM',patience=10):
     csv_logger = CSVLogger(model_folder+'/training-log-'+model_type+'-'+str(test_year)+'.csv')
     filepath = model_folder+"/model-" + model_type + '-' + str(test_year) + "-E{epoch:02d}.h5"
     model_checkpoint = ModelCheckpoint(filepath, monitor='val_loss',save_best_only=True)
-    earlyStopping = EarlyStopping(monitor='val_loss',mode='min',patience=10,restore_best_weights=True)
+    earlyStopping = EarlyStopping(monitor='val_loss',mode='min',patience=patience,restore_best_weights=True)
     return [csv_logger,earlyStopping,model_checkpoint]
 
-def trainer(train_data,test_data,model_type='CuDNNLSTM'):
-    
-    np.random.shuffle(train_data)
-    train_x,train_y = train_data[:,2:-2],train_data[:,-1]
-    train_x = np.reshape(train_x,(len(train_x),sequence_length,1))
-    train_y = np.reshape(train_y,(-1, 1))
-    
-    enc = OneHotEncoder(handle_unknown='ignore')
-    enc.fit(train_y)
-    enc_y = enc.transform(train_y).toarray()
-
+def trainer(train_data,test_data,test_year,model_type='CuDNNLSTM'):
     if model_type == 'LSTM':
         model = makeSimpleLSTM()
     elif model_type == 'CuDNNLSTM':
         model = makeCuDNNLSTM()
     else:
         return
-    callbacks = callbacks_req(model_type)
+    patience = 10
+    if WARM_START and os.path.exists(model_file(test_year-1,model_type)):
+        # start from last year's best weights, with its own early-stopping budget
+        model.set_weights(load_model(model_file(test_year-1,model_type)).get_weights())
+        patience = WARM_PATIENCE
+    callbacks = callbacks_req(test_year,model_type,patience)
     
-    model.fit(train_x,
-              enc_y,
-              epochs=1000,
-              validation_split=0.2,
-              callbacks=callbacks,
-              batch_size=512
-              )
-
-    dates = list(set(test_data[:,0]))
-    predictions = {}
-    for day in dates:
-        test_d = test_data[test_data[:,0]==day]
-        test_d = np.reshape(test_d[:,2:-2],(len(test_d),sequence_length,1))
-        predictions[day] = model.predict(test_d)[:,1]
-    return predictions
+    # batches stream from the memory-mapped features, see lstm_input
+    with instrument.stage('fit'):
+        model.fit(epochs=1000,
+                  callbacks=callbacks,
+                  **stream(train_data,validation_split=0.2,batch_size=512)
+                  )
+        with atomic_path(model_file(test_year,model_type)) as tmp:
+            model.save(tmp)
+
+    with instrument.stage('predict'):
+        predictions = test_data.by_day(model.predict(test_data.x,batch_size=4096)[:,1])
+    return model,predictions
 
 def trained(filename,train_data,test_data):
     model = load_model(filename)
-    dates = list(set(test_data[:,0]))
-    predictions = {}
-    for day in dates:
-        test_d = test_data[test_data[:,0]==day]
-        test_d = np.reshape(test_d[:,2:-2],(len(test_d),sequence_length,1))
-        predictions[day] = model.predict(test_d)[:,1] 
+    predictions = test_data.by_day(model.predict(test_data.x,batch_size=4096)[:,1])
     return predictions    
 
 
-def simulate(test_data,predictions):
-    rets = pd.DataFrame([],columns=['Long','Short'])
-    k = 10
-    for day in sorted(predictions.keys()):
-        preds = predictions[day]
-        test_returns = test_data[test_data[:,0]==day][:,-2]
-        top_preds = predictions[day].argsort()[-k:][::-1] 
-        trans_long = test_returns[top_preds]
-        worst_preds = predictions[day].argsort()[:k][::-1] 
-        trans_short = -test_returns[worst_preds]
-        rets.loc[day] = [np.mean(trans_long),np.mean(trans_short)] 
-        
-    return rets         
+def simulate(test_data,predictions,k=10):
+    dates,pred = test_data.matrix(test_data.from_days(predictions))
+    _,ret = test_data.matrix(test_data.ret)
+    rets = backtest(pred,ret,dates,[k])[k]
+    return rets
 
     
-def create_label(df,perc=[0.5,0.5]):
-    perc = [0.]+list(np.cumsum(perc))
-    label = df.iloc[:,1:].pct_change(fill_method=None)[1:].apply(
-        lambda x: pd.qcut(x.rank(method='first'),perc,labels=False), axis=1)
-    return label
-
-def create_stock_data(df,st):
-    daily_change = df[st].pct_change()
-    st_data = pd.DataFrame([])
-    st_data['Date'] = list(df['Date'])
-    st_data['Name'] = [st]*len(st_data)
-    for k in range(240)[::-1]:
-        st_data['R'+str(k)] = daily_change.shift(k)
-    st_data['R-future'] = daily_change.shift(-1)    
-    st_data['label'] = list(label[st])+[np.nan] 
-    st_data['Month'] = list(df['Date'].str[:-3])
-    st_data = st_data.dropna()
-    
-    trade_year = st_data['Month'].str[:4]
-    st_data = st_data.drop(columns=['Month'])
-    st_train_data = st_data[trade_year<str(test_year)]
-    st_test_data = st_data[trade_year==str(test_year)]
-    return np.array(st_train_data),np.array(st_test_data)
+def create_label(test_year,perc=[0.5,0.5]):
+    label = nextday_label(test_year,tuple(perc))
+    # row t is labelled with day t+1
+    return label.shift(-1)
+
+def create_features(df,stock_names):
+    return [window_family(close_returns(panel(df,stock_names)),240)]
+
+def create_returns(df,stock_names):
+    # R-future: the next day's close-to-close return
+    return shift(close_returns(panel(df,stock_names)),-1)
+
+def create_stock_data(df,label,stock_names):
+    X,t,j,future,lab = build_samples(create_features(df,stock_names),create_returns(df,stock_names),
+                                     label[stock_names].to_numpy(dtype='float64'))
+    return SampleStore(X,t,j,future,lab,df['Date'],stock_names)
 
 def Normalize(train_data,test_data,norm_type='StandardScalar'):
-    scaler = StandardScaler() if norm_type=='StandardScalar' else RobustScaler()
-    scaler.fit(train_data[:,2:-2])
-    train_data[:,2:-2] = scaler.transform(train_data[:,2:-2])
-    test_data[:,2:-2] = scaler.transform(test_data[:,2:-2])
+    # fitted and applied in place a chunk at a time (lstm_input.scale)
+    scale(train_data.x,test_data.x,StandardScaler if norm_type=='StandardScalar' else RobustScaler)
 
-model_folder = 'models-NextDay-240-1-LSTM'
-result_folder = 'results-NextDay-240-1-LSTM'
+model_folder = 'models-NextDay-240-1-LSTM'+('-warm' if WARM_START else '')
+result_folder = 'results-NextDay-240-1-LSTM'+('-warm' if WARM_START else '')
 for directory in [model_folder,result_folder]:
     if not os.path.exists(directory):
         os.makedirs(directory)
+strategy = 'NextDay-240-1-LSTM'
+feature_cache = FeatureCache('cache',strategy)
+prices = load_prices()
 
 model_type = 'CuDNNLSTM'
 norm_type = 'StandardScalar'
-
-for test_year in range(1993,2020):
+sequence_length = 240
+
+def outputs(test_year):
+    # what run_year writes for a year; the runner skips years that have them
+    return [result_folder+'/avg_daily_rets-'+str(test_year)+'.csv',
+            result_folder+'/predictions-'+str(test_year)+'.npz',
+            model_file(test_year,model_type)]
+
+def run_year(test_year):
+    # every year starts from the same random state, so a year gives the
+    # same result run alone, serially or on the scheduler's pool
+    random.seed(SEED)
+    np.random.seed(SEED)
+    tf.set_random_seed(SEED)
     
     print('-'*40)
     print(test_year)
     print('-'*40)
     
-    filename = 'data/Close-'+str(test_year-3)+'.csv'
-    df = pd.read_csv(filename)
+    instrument.begin(strategy,test_year)
+    with instrument.stage('load'):
+        df = frame(test_year,'Close')
     
-    label = create_label(df)
-    stock_names = list(constituents[str(test_year-1)+'-12'])
-    train_data,test_data = [],[]
+    with instrument.stage('create_label'):
+        label = create_label(test_year)
+    stock_names = constituents.members(str(test_year-1)+'-12',df.columns)
     
     start = time.time()
-    for st in stock_names:
-        st_train_data,st_test_data = create_stock_data(df,st)
-        train_data.append(st_train_data)
-        test_data.append(st_test_data)
-
-    train_data = np.concatenate([x for x in train_data])
-    test_data = np.concatenate([x for x in test_data])
-    
-    print('Created :',train_data.shape,test_data.shape,time.time()-start)
-    
-    sequence_length = 240
-    Normalize(train_data,test_data,norm_type)
-    
-    predictions = trainer(train_data,test_data,model_type)
-    returns = simulate(test_data,predictions)
+    # the training features are assembled into a temporary memory-mapped
+    # file the trainer streams its batches from; it is removed once
+    # training is done
+    with spill(os.path.join('cache',strategy+'-train')) as target:
+        with instrument.stage('create_stock_data'):
+            # the years shared with other windows come from the feature cache
+            train_data = feature_cache.samples([df],label,stock_names,range(test_year-3,test_year),
+                                               create_features,create_returns,target.array)
+            test_data = feature_cache.samples([df],label,stock_names,[test_year],
+                                              create_features,create_returns)
+        print('Created :',train_data.shape,test_data.shape,time.time()-start)
+
+        with instrument.stage('normalize'):
+            Normalize(train_data,test_data,norm_type)
+
+        start = time.time()
+        model,predictions = trainer(train_data,test_data,test_year,model_type)
+    # epochs until early stopping, and the best of them, for the warm/cold comparison
+    epochs = len(model.history.history['loss'])
+    best = int(np.argmin(model.history.history['val_loss']))+1
+    train_time = time.time()-start
+    print('Epochs :',epochs,'best',best,'train time',train_time)
+    with instrument.stage('simulate'):
+        returns = simulate(test_data,predictions)
     result = Statistics(returns.sum(axis=1))
     print('\nAverage returns prior to transaction charges')
     result.shortreport() 
     
-    with open(result_folder+'/predictions-'+str(test_year)+'.pickle', 'wb') as handle:
-        pickle.dump(predictions, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    
-    returns.to_csv(result_folder+'/avg_daily_rets-'+str(test_year)+'.csv')
-    with open(result_folder+"/avg_returns.txt", "a") as myfile:
-        res = '-'*30 + '\n' 
-        res += str(test_year) + '\n'
-        res += 'Mean = ' + str(result.mean()) + '\n'
-        res += 'Sharpe = '+str(result.sharpe()) + '\n'
-        res += '-'*30 + '\n'
-        myfile.write(res)
-                
-
+    with instrument.stage('write'):
+        save_predictions(result_folder+'/predictions-'+str(test_year)+'.npz',test_data,
+                         test_data.from_days(predictions))
+        with atomic_open(result_folder+'/avg_daily_rets-'+str(test_year)+'.csv', newline='') as handle:
+            returns.to_csv(handle)
+    instrument.end(result_folder)
+    res = '-'*30 + '\n'
+    res += str(test_year) + '\n'
+    res += 'Mean = ' + str(result.mean()) + '\n'
+    res += 'Sharpe = '+str(result.sharpe()) + '\n'
+    res += 'Epochs = ' + str(epochs) + ' (best ' + str(best) + ')\n'
+    res += 'Train time = ' + str(train_time) + '\n'
+    res += '-'*30 + '\n'
+    return res
+
+
+if __name__ == '__main__':
+    from scheduler import run
+    run(sys.modules[__name__])
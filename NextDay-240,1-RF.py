@@ -1,161 +1,149 @@
-import pandas as pd
 import numpy as np
 import random
 import time
-import pickle
 from sklearn.preprocessing import OneHotEncoder
 from Statistics import Statistics
+from features import panel, shift, close_returns, lag_family, build_samples, flat
+from samples import SampleStore
+from cache import FeatureCache
+from backtest import backtest
+from shared_data import load_constituents, load_prices, frame, nextday_label
+from outputs import atomic_open
+from prediction_store import save_predictions
+import instrument
 from sklearn.ensemble import RandomForestClassifier
+from rolling_forest import RollingForest
+from scheduler import config
 
 import os
+import sys
 SEED = 9
 os.environ['PYTHONHASHSEED']=str(SEED)
 random.seed(SEED)
 np.random.seed(SEED)
-
-SP500_df = pd.read_csv('data/SPXconst.csv')
-all_companies = list(set(SP500_df.values.flatten()))
-#all_companies.remove(np.nan)
-
-constituents = {'-'.join(col.split('/')[::-1]):set(SP500_df[col].dropna()) 
-                for col in SP500_df.columns}
-
-constituents_train = {} 
-for test_year in range(1993,2016):
-    months = [str(t)+'-0'+str(m) if m<10 else str(t)+'-'+str(m) 
-              for t in range(test_year-3,test_year) for m in range(1,13)]
-    constituents_train[test_year] = [list(constituents[m]) for m in months]
-    constituents_train[test_year] = set([i for sublist in constituents_train[test_year] for i in sublist])
+# trees are fitted on N_JOBS cores; the scheduler lowers it per worker
+N_JOBS = -1
+# ROLLING_FOREST=1 in the environment reuses each training year's trees in
+# later windows instead of refitting (see rolling_forest.py). Years then run
+# serially; results go to the -rolling folder.
+ROLLING_FOREST = os.environ.get('ROLLING_FOREST') == '1'
+
+constituents = load_constituents()
  
 
-def trainer(train_data,test_data):
+def trainer(train_data,test_data,test_year):
     random.seed(SEED)
     np.random.seed(SEED)
     
-    train_x,train_y = train_data[:,2:-2],train_data[:,-1]
-    train_y = train_y.astype('int')
-
-
-
-
-    train_x = pd.DataFrame(train_x)
-    train_x = train_x.apply(pd.to_numeric, errors='coerce').to_numpy()
-
-    if not np.isfinite(train_x).all():
-        print("Warning: Need to alter data")
-        train_x = np.nan_to_num(train_x, nan=0.0, posinf=1000, neginf=-1000)
-
-    #Clip like assignment 1
-    train_x = np.clip(train_x, -1000, 1000)
-
-
+    train_x,train_y = train_data.x,train_data.label
 
     print('Started training')
-    clf = RandomForestClassifier(n_estimators=1000, max_depth=20, random_state = SEED, n_jobs=-1)
-    clf.fit(train_x,train_y)
-    print('Completed ',clf.score(train_x,train_y))
-
-    dates = list(set(test_data[:,0]))
-    predictions = {}
-    for day in dates:
-        test_d = test_data[test_data[:,0]==day]
-        test_d = test_d[:,2:-2] 
-
-
-        test_d = pd.DataFrame(test_d).apply(pd.to_numeric, errors='coerce').to_numpy()
-
-        if not np.isfinite(test_d).all():
-            #print("Warning: Need to alter data")
-            test_d = np.nan_to_num(test_d, nan=0.0, posinf=1000, neginf=-1000)
-
-        #Like assignemnt 1
-        test_d = np.clip(test_d, -1000, 1000)
-
-
-        predictions[day] = clf.predict_proba(test_d)[:,1]
-    return predictions
-
-
-def simulate(test_data,predictions):
-    rets = pd.DataFrame([],columns=['Long','Short'])
-    k = 10
-    for day in sorted(predictions.keys()):
-        preds = predictions[day]
-        test_returns = test_data[test_data[:,0]==day][:,-2]
-        top_preds = predictions[day].argsort()[-k:][::-1] 
-        trans_long = test_returns[top_preds]
-        worst_preds = predictions[day].argsort()[:k][::-1] 
-        trans_short = -test_returns[worst_preds]
-        rets.loc[day] = [np.mean(trans_long),np.mean(trans_short)] 
+    with instrument.stage('fit'):
+        if ROLLING_FOREST:
+            forest = RollingForest('cache',strategy,n_estimators=1000,max_depth=20,
+                                   random_state=SEED,n_jobs=N_JOBS,
+                                   config=config(__file__,prices.folder))
+            clf = forest.fit(train_x,train_y,train_data.years(),test_year)
+            grown = forest.grown
+        else:
+            clf = RandomForestClassifier(n_estimators=1000,max_depth=20,random_state=SEED,n_jobs=N_JOBS)
+            clf.fit(train_x,train_y)
+            grown = clf.n_estimators
+        print('Completed ',clf.score(train_x,train_y))
+
+    test_x = test_data.x
+    with instrument.stage('predict'):
+        predictions = test_data.by_day(clf.predict_proba(test_x)[:,1])
+    return grown,predictions
+
+
+def simulate(test_data,predictions,k=10):
+    dates,pred = test_data.matrix(test_data.from_days(predictions))
+    _,ret = test_data.matrix(test_data.ret)
+    rets = backtest(pred,ret,dates,[k])[k]
     return rets   
     
-def create_label(df,perc=[0.5,0.5]):
-    perc = [0.]+list(np.cumsum(perc))
-    label = df.iloc[:,1:].pct_change(fill_method=None)[1:].apply(
-        lambda x: pd.qcut(x.rank(method='first'),perc,labels=False), axis=1)
-    return label
+def create_label(test_year,perc=[0.5,0.5]):
+    label = nextday_label(test_year,tuple(perc))
+    # row t is labelled with day t+1
+    return label.shift(-1)
 
-def create_stock_data(df,st):
-    st_data = pd.DataFrame([])
-    st_data['Date'] = list(df['Date'])
-    st_data['Name'] = [st]*len(st_data)
-    for k in list(range(1,21))+list(range(40,241,20)):
-        st_data['R'+str(k)] = df[st].pct_change(k)
-    st_data['R-future'] = df[st].pct_change().shift(-1)    
-    st_data['label'] = list(label[st])+[np.nan] 
-    st_data['Month'] = list(df['Date'].str[:-3])
-    st_data = st_data.dropna()
-    
-    trade_year = st_data['Month'].str[:4]
-    st_data = st_data.drop(columns=['Month'])
-    st_train_data = st_data[trade_year<str(test_year)]
-    st_test_data = st_data[trade_year==str(test_year)]
-    return np.array(st_train_data),np.array(st_test_data)
+def create_features(df,stock_names):
+    cl = panel(df,stock_names)
+    return [lag_family(cl,cl,list(range(1,21))+list(range(40,241,20)))]
 
-result_folder = 'results-NextDay-240-1-RF'
+def create_returns(df,stock_names):
+    # R-future: the next day's close-to-close return
+    return shift(close_returns(panel(df,stock_names)),-1)
+
+def create_stock_data(df,label,stock_names):
+    X,t,j,future,lab = build_samples(create_features(df,stock_names),create_returns(df,stock_names),
+                                     label[stock_names].to_numpy(dtype='float64'))
+    return SampleStore(flat(X),t,j,future,lab,df['Date'],stock_names)
+
+result_folder = 'results-NextDay-240-1-RF'+('-rolling' if ROLLING_FOREST else '')
 for directory in [result_folder]:
     if not os.path.exists(directory):
         os.makedirs(directory)
+strategy = 'NextDay-240-1-RF'
+feature_cache = FeatureCache('cache',strategy,flat=True)
+prices = load_prices()
+
+def outputs(test_year):
+    # what run_year writes for a year; the runner skips years that have them
+    return [result_folder+'/avg_daily_rets-'+str(test_year)+'.csv',
+            result_folder+'/predictions-'+str(test_year)+'.npz']
 
-for test_year in range(1993,2020):
+def run_year(test_year):
     
     print('-'*40)
     print(test_year)
     print('-'*40)
     
-    filename = 'data/Close-'+str(test_year-3)+'.csv'
-    df = pd.read_csv(filename)
+    instrument.begin(strategy,test_year)
+    with instrument.stage('load'):
+        df = frame(test_year,'Close')
     
-    label = create_label(df)
-    stock_names = sorted(list(constituents[str(test_year-1)+'-12']))
-    train_data,test_data = [],[]
+    with instrument.stage('create_label'):
+        label = create_label(test_year)
+    stock_names = constituents.members(str(test_year-1)+'-12',df.columns)
     
     start = time.time()
-    for st in stock_names:
-        st_train_data,st_test_data = create_stock_data(df,st)
-        train_data.append(st_train_data)
-        test_data.append(st_test_data)
-
-    train_data = np.concatenate([x for x in train_data])
-    test_data = np.concatenate([x for x in test_data])
+    with instrument.stage('create_stock_data'):
+        # the years shared with other windows come from the feature cache
+        train_data = feature_cache.samples([df],label,stock_names,range(test_year-3,test_year),
+                                           create_features,create_returns)
+        test_data = feature_cache.samples([df],label,stock_names,[test_year],
+                                          create_features,create_returns)
     
     print('Created :',train_data.shape,test_data.shape,time.time()-start)
     
     
-    predictions = trainer(train_data,test_data)
-    returns = simulate(test_data,predictions)
+    start = time.time()
+    grown,predictions = trainer(train_data,test_data,test_year)
+    fit_time = time.time()-start
+    with instrument.stage('simulate'):
+        returns = simulate(test_data,predictions)
     result = Statistics(returns.sum(axis=1))
     print('\nAverage returns prior to transaction charges')
     result.shortreport() 
     
-    with open(result_folder+'/predictions-'+str(test_year)+'.pickle', 'wb') as handle:
-        pickle.dump(predictions, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    
-    returns.to_csv(result_folder+'/avg_daily_rets-'+str(test_year)+'.csv')
-    with open(result_folder+"/avg_returns.txt", "a") as myfile:
-        res = '-'*30 + '\n' 
-        res += str(test_year) + '\n'
-        res += 'Mean = ' + str(result.mean()) + '\n'
-        res += 'Sharpe = '+str(result.sharpe()) + '\n'
-        res += '-'*30 + '\n'
-        myfile.write(res)
+    with instrument.stage('write'):
+        save_predictions(result_folder+'/predictions-'+str(test_year)+'.npz',test_data,
+                         test_data.from_days(predictions))
+        with atomic_open(result_folder+'/avg_daily_rets-'+str(test_year)+'.csv', newline='') as handle:
+            returns.to_csv(handle)
+    instrument.end(result_folder)
+    res = '-'*30 + '\n'
+    res += str(test_year) + '\n'
+    res += 'Mean = ' + str(result.mean()) + '\n'
+    res += 'Sharpe = '+str(result.sharpe()) + '\n'
+    res += 'Fit time = ' + str(fit_time) + '\n'
+    res += 'Trees grown = ' + str(grown) + '\n'
+    res += '-'*30 + '\n'
+    return res
+
+
+if __name__ == '__main__':
+    from scheduler import run
+    run(sys.modules[__name__])
@@ -1,6 +1,15 @@
+import argparse
+import glob
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import scipy.stats
+from outputs import atomic_open
+
+BOOTSTRAP_CHUNK = 1000
 
 class Statistics:
     def __init__(self,series):
@@ -15,17 +24,17 @@ class Statistics:
     def percentiles(self,p=[.25,.5,.75]):
         return pd.Series(self.series).describe(percentiles=p)
     def pos_perc(self):
-        return 100*sum(self.series>0)/self.n
+        return 100*np.count_nonzero(self.series>0)/self.n
     def skewness(self):
         return scipy.stats.skew(self.series)
     def kurtosis(self):
         return scipy.stats.kurtosis(self.series)
     def VaR(self,confidence):
         indx = int(confidence*self.n/100)
-        return sorted(self.series)[indx-1]
+        return np.partition(self.series,indx-1)[indx-1]
     def CVaR(self,confidence):
         indx = int(confidence*self.n/100)
-        return sum(sorted(self.series)[:indx])/indx
+        return np.sum(np.partition(self.series,indx-1)[:indx])/indx
     def MDD(self):
         money = np.cumprod(1+self.series/100)
         maximums = np.maximum.accumulate(money)
@@ -56,4 +65,300 @@ class Statistics:
         print('CVaR_5 \t\t',self.CVaR(5))
         print('MDD \t\t',self.MDD())
         print(self.percentiles())
+    def bootstrap(self,resamples=10000,block=None,alpha=0.05,seed=0):
+        # {'Mean': (low, high), 'Sharpe': .., 'MDD': ..}, see bootstrap()
+        row = bootstrap([self.series],resamples,block,alpha,seed).iloc[0]
+        return {m:(row[m+' low'],row[m+' high']) for m in ('Mean','Sharpe','MDD')}
         
+
+
+class BatchStatistics:
+    # the Statistics measures for many series at once: one row per series,
+    # one column per day; every method returns one value per row
+    def __init__(self,matrix,index=None):
+        self.matrix = np.atleast_2d(np.asarray(matrix,dtype='float64'))
+        self.n = self.matrix.shape[1]
+        self.index = index
+    def mean(self):
+        return np.mean(self.matrix,axis=1)
+    def std(self):
+        return np.std(self.matrix,axis=1)
+    def stderr(self):
+        return scipy.stats.sem(self.matrix,axis=1)
+    def percentiles(self,p=[.25,.5,.75]):
+        q = np.percentile(self.matrix,[0]+[100*x for x in p]+[100],axis=1).T
+        cols = ['min']+['{:g}%'.format(100*x) for x in p]+['max']
+        out = pd.DataFrame(q,columns=cols,index=self.index)
+        out.insert(0,'std',np.std(self.matrix,axis=1,ddof=1))
+        out.insert(0,'mean',self.mean())
+        out.insert(0,'count',float(self.n))
+        return out
+    def pos_perc(self):
+        return 100*np.count_nonzero(self.matrix>0,axis=1)/self.n
+    def skewness(self):
+        return scipy.stats.skew(self.matrix,axis=1)
+    def kurtosis(self):
+        return scipy.stats.kurtosis(self.matrix,axis=1)
+    def tail(self,confidences=(1,2,5)):
+        # VaR and CVaR at every confidence from a single partition; both
+        # (rows x confidences)
+        indx = np.array([int(c*self.n/100) for c in confidences])
+        kth = (indx-1) % self.n
+        part = np.partition(self.matrix,np.unique(kth),axis=1)
+        var = part[:,kth]
+        total = np.concatenate([np.zeros((len(part),1)),np.cumsum(part,axis=1)],axis=1)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            cvar = total[:,indx]/indx
+        return var,cvar
+    def VaR(self,confidence):
+        return self.tail([confidence])[0][:,0]
+    def CVaR(self,confidence):
+        return self.tail([confidence])[1][:,0]
+    def MDD(self):
+        money = np.cumprod(1+self.matrix/100,axis=1)
+        maximums = np.maximum.accumulate(money,axis=1)
+        # 1 - min(money/maximums), in place on the running peaks
+        return 1 - np.min(np.divide(money,maximums,out=maximums),axis=1)
+    def sharpe(self,risk_free_rate = 0.0003):
+        mu = self.mean()
+        sig = self.std()
+        sharpe_d = (mu-risk_free_rate)/sig
+        return (252**0.5)*sharpe_d
+    def summary(self,confidences=(1,2,5)):
+        # every measure of report(), one row per series
+        var,cvar = self.tail(confidences)
+        out = pd.DataFrame({'Mean':self.mean(),'Standard dev':self.std(),'Sharpe ratio':self.sharpe(),
+                            'Standard Error':self.stderr(),'Share>0':self.pos_perc(),
+                            'Skewness':self.skewness(),'Kurtosis':self.kurtosis()},index=self.index)
+        for i,c in enumerate(confidences):
+            out['VaR_'+str(c)] = var[:,i]
+        for i,c in enumerate(confidences):
+            out['CVaR_'+str(c)] = cvar[:,i]
+        out['MDD'] = self.MDD()
+        return out
+    def report(self):
+        print(self.summary().T)
+        print(self.percentiles().T)
+    def bootstrap(self,resamples=10000,block=None,alpha=0.05,seed=0,workers=1):
+        return bootstrap(list(self.matrix),resamples,block,alpha,seed,workers,self.index)
+
+
+class OnlineStatistics:
+    # Statistics for a series that grows one day at a time, in O(1) per day:
+    # Welford mean/variance with third and fourth central moments, the money
+    # curve's running peak and maximum drawdown, and a P^2 quantile sketch
+    # (Jain & Chlamtac, one marker per tracked probability) for VaR at
+    # `confidences`. Every marker also carries the running sum of the days
+    # below it, moved along with the marker, which gives CVaR. Until it has
+    # seen as many days as it has markers the sketch is the exact sorted
+    # series. state()/from_state() and save()/load() checkpoint it as JSON.
+    def __init__(self,confidences=(1,2,5)):
+        self.confidences = list(confidences)
+        # markers at quarters of every confidence keep the tail finely resolved
+        tail = {c/100*j/4 for c in self.confidences for j in (1,2,3,4)}
+        self.probs = sorted(tail | {0.,.25,.5,.75,1.})
+        self.marker = {c:self.probs.index(c/100*4/4) for c in self.confidences}
+        self.n = 0
+        self.mu = self.m2 = self.m3 = self.m4 = 0.
+        self.positive = 0
+        self.money = 1.
+        self.peak = -np.inf
+        self.mdd = 0.
+        self.heights = []
+        self.positions = []
+        self.below = []
+    def update(self,x):
+        x = float(x)
+        n1 = self.n
+        self.n += 1
+        n = self.n
+        delta = x-self.mu
+        delta_n = delta/n
+        term = delta*delta_n*n1
+        self.mu += delta_n
+        self.m4 += term*delta_n**2*(n*n-3*n+3)+6*delta_n**2*self.m2-4*delta_n*self.m3
+        self.m3 += term*delta_n*(n-2)-3*delta_n*self.m2
+        self.m2 += term
+        self.positive += x > 0
+        self.money *= 1+x/100
+        self.peak = max(self.peak,self.money)
+        self.mdd = max(self.mdd,1-self.money/self.peak)
+        self._sketch(x)
+        return self
+    def extend(self,series):
+        for x in series:
+            self.update(x)
+        return self
+    def _sketch(self,x):
+        q,pos,below,m = self.heights,self.positions,self.below,len(self.probs)
+        if self.n <= m:
+            q.insert(np.searchsorted(q,x,side='right'),x)
+            pos[:] = list(range(1,len(q)+1))
+            below[:] = list(np.cumsum([0.]+q[:-1]))
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[-1]:
+            # the old maximum drops below the last marker, x becomes it
+            q[-1],x = x,q[-1]
+            k = m-2
+        else:
+            k = min(int(np.searchsorted(q,x,side='right'))-1,m-2)
+        for i in range(k+1,m):
+            pos[i] += 1
+            below[i] += x
+        for i in range(1,m-1):
+            d = 1+(self.n-1)*self.probs[i]-pos[i]
+            if (d >= 1 and pos[i+1]-pos[i] > 1) or (d <= -1 and pos[i-1]-pos[i] < -1):
+                s = 1 if d > 0 else -1
+                # piecewise-parabolic prediction, linear if it leaves the cell
+                h = q[i]+s/(pos[i+1]-pos[i-1])*((pos[i]-pos[i-1]+s)*(q[i+1]-q[i])/(pos[i+1]-pos[i])
+                                               +(pos[i+1]-pos[i]-s)*(q[i]-q[i-1])/(pos[i]-pos[i-1]))
+                if not q[i-1] < h < q[i+1]:
+                    h = q[i]+s*(q[i+s]-q[i])/(pos[i+s]-pos[i])
+                # the day the marker steps over joins or leaves its tail
+                below[i] += q[i] if s > 0 else -h
+                q[i] = h
+                pos[i] += s
+    def mean(self):
+        return self.mu
+    def std(self):
+        return (self.m2/self.n)**0.5
+    def stderr(self):
+        return (self.m2/(self.n-1)/self.n)**0.5
+    def pos_perc(self):
+        return 100*self.positive/self.n
+    def skewness(self):
+        return self.n**0.5*self.m3/self.m2**1.5
+    def kurtosis(self):
+        return self.n*self.m4/self.m2**2-3
+    def VaR(self,confidence):
+        if self.n <= len(self.probs):
+            return Statistics(self.heights).VaR(confidence)
+        return self.heights[self.marker[confidence]]
+    def CVaR(self,confidence):
+        # the mean of the days up to and including the VaR marker
+        if self.n <= len(self.probs):
+            return Statistics(self.heights).CVaR(confidence)
+        i = self.marker[confidence]
+        return (self.below[i]+self.heights[i])/self.positions[i]
+    def MDD(self):
+        return self.mdd
+    def sharpe(self,risk_free_rate = 0.0003):
+        mu = self.mean()
+        sig = self.std()
+        sharpe_d = (mu-risk_free_rate)/sig
+        return (252**0.5)*sharpe_d
+    def shortreport(self):
+        print('Mean \t\t',self.mean())
+        print('Standard dev \t',self.std())
+        print('Sharpe ratio \t',self.sharpe())
+    def report(self):
+        self.shortreport()
+        print('Standard Error \t',self.stderr())
+        print('Share>0 \t',self.pos_perc())
+        print('Skewness \t',self.skewness())
+        print('Kurtosis \t',self.kurtosis())
+        for c in self.confidences:
+            print('VaR_'+str(c)+' \t\t',self.VaR(c))
+        for c in self.confidences:
+            print('CVaR_'+str(c)+' \t\t',self.CVaR(c))
+        print('MDD \t\t',self.MDD())
+    def state(self):
+        return {k:v for k,v in vars(self).items() if k not in ('probs','marker')}
+    @classmethod
+    def from_state(cls,state):
+        out = cls(state['confidences'])
+        for k,v in state.items():
+            setattr(out,k,list(v) if isinstance(v,list) else v)
+        return out
+    def save(self,path):
+        with atomic_open(path) as f:
+            json.dump(self.state(),f)
+    @classmethod
+    def load(cls,path):
+        with open(path) as f:
+            return cls.from_state(json.load(f))
+
+
+def block_starts(n,resamples,block,rng):
+    # circular block bootstrap: every resample is n days taken as runs of
+    # `block` consecutive days; this is the (resamples x blocks) index matrix
+    # of the days the runs start at
+    return rng.integers(0,n,size=(resamples,-(-n//block)))
+
+
+def block_resample(series,starts,block):
+    # the resampled series, (resamples x n): row i of the block view of the
+    # series wrapped past its end holds the run starting at day i
+    n = len(series)
+    runs = np.lib.stride_tricks.sliding_window_view(np.concatenate([series,series[:block-1]]),block)
+    return runs[starts].reshape(len(starts),-1)[:,:n]
+
+
+def _bootstrap(job):
+    series,resamples,block,alpha,seed = job
+    series = np.asarray(series,dtype='float64')
+    n = len(series)
+    block = min(block or max(int(round(n**(1/3))),1),n)
+    rng = np.random.default_rng(seed)
+    stats = []
+    with np.errstate(divide='ignore',invalid='ignore'):
+        for start in range(0,resamples,BOOTSTRAP_CHUNK):
+            starts = block_starts(n,min(BOOTSTRAP_CHUNK,resamples-start),block,rng)
+            b = BatchStatistics(block_resample(series,starts,block))
+            stats.append(np.stack([b.mean(),b.sharpe(),b.MDD()],axis=1))
+    return np.nanpercentile(np.concatenate(stats),[50*alpha,100-50*alpha],axis=0).T.ravel()
+
+
+def bootstrap(series,resamples=10000,block=None,alpha=0.05,seed=0,workers=1,index=None):
+    # percentile confidence intervals of Mean, Sharpe and MDD for each of a
+    # list of daily return series (lengths may differ), one row per series.
+    # The resamples of a series are block index matrices, evaluated in chunks
+    # with BatchStatistics; workers > 1 shards the series over processes. Series i
+    # always draws from seed (seed, i), so results do not depend on workers.
+    # block: days per block, by default n**(1/3)
+    jobs = [(s,resamples,block,alpha,(seed,i)) for i,s in enumerate(series)]
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            rows = list(pool.map(_bootstrap,jobs,chunksize=max(len(jobs)//(4*workers),1)))
+    else:
+        rows = [_bootstrap(job) for job in jobs]
+    cols = [m+' '+b for m in ('Mean','Sharpe','MDD') for b in ('low','high')]
+    return pd.DataFrame(np.reshape(rows,(len(rows),len(cols))),columns=cols,index=index)
+
+
+def bootstrap_results(folders,resamples=10000,block=None,alpha=0.05,seed=0,workers=1):
+    # confidence intervals for every year of each results folder (daily
+    # Long+Short returns from avg_daily_rets-YYYY.csv) and for all years
+    # together; written to <folder>/bootstrap.csv
+    series,index = [],[]
+    for folder in folders:
+        years = []
+        for path in sorted(glob.glob(os.path.join(folder,'avg_daily_rets-*.csv'))):
+            year = re.findall(r'avg_daily_rets-(\d{4})\.csv$',path)[0]
+            years.append(pd.read_csv(path,index_col=0).sum(axis=1).to_numpy())
+            index.append((folder,year))
+        series += years+[np.concatenate(years)] if years else []
+        index += [(folder,'All')] if years else []
+    table = bootstrap(series,resamples,block,alpha,seed,workers,pd.MultiIndex.from_tuples(index,names=['Folder','Year']))
+    table.insert(0,'Sharpe',[Statistics(s).sharpe() for s in series])
+    table.insert(0,'Mean',[Statistics(s).mean() for s in series])
+    for folder in folders:
+        if folder in table.index.get_level_values(0):
+            table.loc[folder].to_csv(os.path.join(folder,'bootstrap.csv'))
+    return table
+
+
+if __name__ == '__main__':
+    # python Statistics.py results-Intraday-240-3-LSTM results-Intraday-240-3-RF --workers 4
+    parser = argparse.ArgumentParser(description='Block-bootstrap confidence intervals of the yearly returns')
+    parser.add_argument('folders',nargs='+')
+    parser.add_argument('--resamples',type=int,default=10000)
+    parser.add_argument('--block',type=int,default=None,help='days per block, default n**(1/3)')
+    parser.add_argument('--alpha',type=float,default=0.05)
+    parser.add_argument('--workers',type=int,default=1)
+    args = parser.parse_args()
+    with pd.option_context('display.width',200,'display.max_rows',None):
+        print(bootstrap_results(args.folders,args.resamples,args.block,args.alpha,workers=args.workers))
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+
+def _leg(score,ret,valid,ks,largest):
+    # mean return of the k highest (or lowest) scored tickers per day, for
+    # every k in ks; invalid tickers must already score last
+    n = score.shape[1]
+    kmax = min(max(ks),n)
+    if largest:
+        idx = np.argpartition(score,n-kmax,axis=1)[:,n-kmax:]
+    else:
+        idx = np.argpartition(score,kmax-1,axis=1)[:,:kmax]
+    # order the kmax picks so that the top-k sets are nested
+    picked = np.take_along_axis(score,idx,1)
+    best = np.argsort(-picked if largest else picked,axis=1,kind='stable')
+    idx = np.take_along_axis(idx,best,1)
+    ok = np.take_along_axis(valid,idx,1)
+    total = np.cumsum(np.where(ok,np.take_along_axis(ret,idx,1),0.),axis=1)
+    count = np.cumsum(ok,axis=1)
+    cols = np.minimum(ks,kmax)-1
+    with np.errstate(invalid='ignore'):
+        return total[:,cols]/count[:,cols]
+
+
+def long_short(pred,ret,ks=(10,)):
+    # pred, ret: (days x tickers) matrices, NaN where a ticker has no sample.
+    # Long buys the k highest predictions, Short sells the k lowest; days with
+    # fewer than k tickers use all of them. Returns two (days x len(ks)) arrays.
+    ks = np.atleast_1d(ks)
+    valid = ~np.isnan(pred)
+    long = _leg(np.where(valid,pred,-np.inf),ret,valid,ks,True)
+    short = -_leg(np.where(valid,pred,np.inf),ret,valid,ks,False)
+    return long,short
+
+
+def backtest(pred,ret,dates,ks=(10,)):
+    # {k: DataFrame of daily Long/Short returns indexed by date}
+    long,short = long_short(pred,ret,ks)
+    return {k:pd.DataFrame({'Long':long[:,i],'Short':short[:,i]},index=dates)
+            for i,k in enumerate(np.atleast_1d(ks))}
@@ -0,0 +1,202 @@
+import argparse
+import contextlib
+import inspect
+import io
+import os
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import instrument
+import scheduler
+import shared_data
+from outputs import atomic_open
+from price_store import write_store
+from Statistics import Statistics
+from universe import Universe, write_spxconst
+
+# Benchmarks of the data preparation and backtest paths on a seeded synthetic
+# market, so they can be measured without the downloaded data. For every
+# scale (number of tickers x number of test years) a price store and an
+# SPXconst-style constituents file are generated into a scratch folder, the
+# strategy scripts are loaded there, and every test year runs their own
+# create_label, create_stock_data, scalar_normalize / Normalize (the LSTM
+# scripts), simulate (on seeded random predictions) and Statistics.report
+# under instrument.stage. Nothing is trained.
+#
+# Each strategy-year is timed cold: the shared_data window and label caches
+# are cleared first. Records go to <out>/timings.jsonl (see instrument.py)
+# and the per-stage totals of every scale are appended to
+# <out>/benchmark.csv, tagged with the git commit, for comparing versions and
+# plotting scaling curves.
+#
+#   python benchmark.py
+#   python benchmark.py --tickers 50 500 5000 --years 1 5 30 --strategies Intraday-240,3-RF
+
+STRATEGIES = ['Intraday-240,1-LSTM','Intraday-240,3-RF']
+TICKERS = [50,500]
+YEARS = [1,5]
+FIRST_YEAR = 1990
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIELDS = {'df':'Close','df_open':'Open','df_close':'Close'}
+
+
+def synthetic_market(tickers,years,seed=0,first_year=FIRST_YEAR,listed=0.8,missing=0.001,block=500):
+    # (dates, names, {'Open', 'Close'}, Universe) for `years` test years and
+    # the three years of history before them. A share `listed` of the tickers
+    # is listed throughout, the others list and/or delist at a random day;
+    # prices are NaN outside the listing and on a share `missing` of the days
+    # inside it. Membership is the listing, so the constituents change
+    # monthly as tickers come and go. Log prices are a random walk: a market
+    # and an own intraday return plus an overnight gap.
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(str(first_year),str(first_year+years+3),inclusive='left')
+    days = np.asarray(dates.values,dtype='datetime64[D]')
+    names = ['S%04d'%i for i in range(tickers)]
+    start = np.where(rng.random(tickers) < listed,0,rng.integers(0,len(days),tickers))
+    end = np.where(rng.random(tickers) < listed,len(days),rng.integers(0,len(days),tickers))
+    start,end = np.minimum(start,end),np.maximum(start,end)
+    end[start == end] = len(days)
+    market = rng.normal(0.0002,0.01,len(days))
+    fields = {'Open':np.empty((len(days),tickers)),'Close':np.empty((len(days),tickers))}
+    for lo in range(0,tickers,block):
+        n = min(block,tickers-lo)
+        beta = rng.uniform(0.5,1.5,n)
+        intraday = market[:,None]*beta+rng.normal(0,1,(len(days),n))*rng.uniform(0.005,0.02,n)
+        gap = rng.normal(0,0.005,(len(days),n))
+        close = np.log(rng.uniform(10,100,n))+np.cumsum(gap+intraday,axis=0)
+        fields['Close'][:,lo:lo+n] = np.exp(close)
+        fields['Open'][:,lo:lo+n] = np.exp(close-intraday)
+    rows = np.arange(len(days))[:,None]
+    out = (rows < start) | (rows >= end) | (rng.random((len(days),tickers)) < missing)
+    for values in fields.values():
+        values[out] = np.nan
+    ends = np.append(days,days[-1]+1)
+    universe = Universe(names,np.arange(tickers),days[start],ends[end])
+    return dates.strftime('%Y-%m-%d').to_numpy(),names,fields,universe
+
+
+def write_market(folder,tickers,years,seed=0,first_year=FIRST_YEAR):
+    # data/prices and data/SPXconst.csv of a synthetic market under folder
+    dates,names,fields,universe = synthetic_market(tickers,years,seed,first_year)
+    write_store(os.path.join(folder,'data','prices'),dates,names,fields)
+    write_spxconst(universe,os.path.join(folder,'data','SPXconst.csv'),
+                   '%d-01'%first_year,'%d-12'%(first_year+years+2))
+
+
+def clear_caches(constituents=False):
+    for f in [shared_data.frame,shared_data.intraday_label,shared_data.nextday_label]:
+        f.cache_clear()
+    if constituents:
+        shared_data.load_constituents.cache_clear()
+        shared_data.load_prices.cache_clear()
+
+
+def frames(module,test_year):
+    # the price frames create_stock_data takes, in its own argument order
+    params = list(inspect.signature(module.create_stock_data).parameters)
+    return [shared_data.frame(test_year,FIELDS[p]) for p in params[:params.index('label')]]
+
+
+def bench_year(module,test_year,seed=0):
+    # one cold strategy-year under the current instrument record
+    clear_caches()
+    with instrument.stage('load'):
+        dfs = frames(module,test_year)
+    with instrument.stage('create_label'):
+        label = module.create_label(test_year)
+    stock_names = module.constituents.members(str(test_year-1)+'-12',dfs[0].columns)
+    with instrument.stage('create_stock_data'):
+        train_data,test_data = module.create_stock_data(*dfs,label,stock_names).split(test_year)
+    normalize = getattr(module,'scalar_normalize',None) or getattr(module,'Normalize',None)
+    if normalize is not None:
+        with instrument.stage('normalize'):
+            normalize(train_data,test_data)
+    predictions = test_data.by_day(np.random.default_rng(seed).random(len(test_data)))
+    with instrument.stage('simulate'):
+        returns = module.simulate(test_data,predictions)
+    with instrument.stage('report'):
+        Statistics(returns.sum(axis=1)).report()
+    return len(train_data)+len(test_data)
+
+
+def version():
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],cwd=HERE,capture_output=True,
+                              text=True,check=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def bench_scale(strategies,tickers,years,out,seed=0,label=None):
+    # records of every strategy and test year at one scale
+    records = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        write_market(folder,tickers,years,seed)
+        print('%d tickers x %d years: market generated in %.1fs'%(tickers,years,time.perf_counter()-start))
+        os.chdir(folder)
+        try:
+            clear_caches(constituents=True)
+            for name in strategies:
+                # the scripts' own progress output is dropped
+                with contextlib.redirect_stdout(io.StringIO()):
+                    module = scheduler.load(os.path.join(HERE,name if name.endswith('.py') else name+'.py'))
+                for test_year in range(FIRST_YEAR+3,FIRST_YEAR+3+years):
+                    record = instrument.begin(name,test_year)
+                    record.update(tickers=tickers,years=years,seed=seed,version=label or version())
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        record['samples'] = bench_year(module,test_year,seed)
+                    records.append(instrument.end(out))
+        finally:
+            os.chdir(cwd)
+            clear_caches(constituents=True)
+    return records
+
+
+def summarize(records):
+    # one row per (strategy, tickers, years, stage): totals over the test
+    # years, the mean wall time per year and the largest peak RSS
+    rows = []
+    for r in records:
+        for s in r['stages']:
+            rows.append({'version':r['version'],'strategy':r['strategy'],'tickers':r['tickers'],
+                         'years':r['years'],'stage':s['stage'],'wall':s['wall'],'cpu':s['cpu'],
+                         'peak_rss_mb':s['peak_rss_mb'],'samples':r['samples']})
+    df = pd.DataFrame(rows)
+    keys = ['version','strategy','tickers','years','stage']
+    out = df.groupby(keys,sort=False).agg(wall=('wall','sum'),cpu=('cpu','sum'),wall_per_year=('wall','mean'),
+                                          peak_rss_mb=('peak_rss_mb','max'),samples=('samples','sum'))
+    return out.reset_index()
+
+
+def run(strategies=STRATEGIES,tickers=TICKERS,years=YEARS,out='benchmarks',seed=0,label=None):
+    if not os.path.exists(out):
+        os.makedirs(out)
+    out = os.path.abspath(out)
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S')
+    for n in tickers:
+        for y in years:
+            summary = summarize(bench_scale(strategies,n,y,out,seed,label))
+            summary.insert(1,'date',stamp)
+            print(summary.drop(columns=['version','date']).to_string(index=False))
+            # appended scale by scale, so a long run keeps what it finished
+            path = os.path.join(out,'benchmark.csv')
+            if os.path.exists(path):
+                summary = pd.concat([pd.read_csv(path),summary],ignore_index=True)
+            with atomic_open(path,newline='') as handle:
+                summary.to_csv(handle,index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time data preparation and backtesting on synthetic markets')
+    parser.add_argument('--strategies',nargs='+',default=STRATEGIES)
+    parser.add_argument('--tickers',type=int,nargs='+',default=TICKERS,help='universe sizes, e.g. 50 500 5000')
+    parser.add_argument('--years',type=int,nargs='+',default=YEARS,help='numbers of test years, e.g. 1 5 30')
+    parser.add_argument('--out',default='benchmarks')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--label',default=None,help='version tag of the rows (default: the git commit)')
+    args = parser.parse_args()
+    run(args.strategies,args.tickers,args.years,args.out,args.seed,args.label)
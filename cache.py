@@ -0,0 +1,221 @@
+import glob
+import hashlib
+import inspect
+import os
+import numpy as np
+import features
+from features import gather, sample_index
+from samples import SampleStore
+from outputs import atomic_path
+
+# Consecutive walk-forward windows share three of their four years, and the
+# features of a day only read that day's, the `lookback` earlier and the
+# `lead` later price rows (1 for NextR, which reads the next open). The cache
+# keeps the features of every calendar year -- x, day and
+# ticker of each sample whose feature families are complete -- in
+# cache/<name>-<year>.npz plus a cache/<name>-<year>-<key>.npy of x, with a
+# content hash per ticker of the price rows they read. A window only builds
+# the tickers and years whose hash is new, and a changed price file
+# invalidates exactly the blocks that read the changed rows.
+#
+# The targets are not cached: labels are ranked over each window's own
+# universe (shared_data.window_tickers) and the last day's next-day return
+# needs the following year. ret and label are gathered from the window's own
+# matrices when the samples are assembled, dropping the rows where either is
+# NaN as build_samples does. A year whose rows are cut off by the window (the
+# first year's look-back, with a lead the last year's following day) yields
+# fewer samples than the same year inside a window; it is built directly and
+# never stored.
+
+
+def _source(obj):
+    try:
+        return inspect.getsource(obj)
+    except (OSError,TypeError):
+        return obj.__code__.co_code
+
+
+def _digest(*parts):
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p if isinstance(p,bytes) else str(p).encode())
+    return h.hexdigest()
+
+
+def _copy(out,dest,x,rows,chunk_bytes=1 << 26):
+    # out[dest] = x[rows], a chunk of rows at a time, so that memory-mapped
+    # blocks are never read in whole
+    step = max(1,chunk_bytes//max(x[:1].nbytes,1))
+    for s in range(0,len(rows),step):
+        out[dest[s:s+step]] = x[rows[s:s+step]]
+
+
+def _codes(names,tickers):
+    # position of every name in tickers, -1 where it is not one
+    index = {t:i for i,t in enumerate(tickers)}
+    return np.array([index.get(t,-1) for t in names],dtype='int64')
+
+
+class FeatureCache:
+    def __init__(self,folder,name,lookback=242,lead=0,flat=False):
+        # flat: x as features.flat(X), the RF scripts' layout
+        self.folder = folder
+        self.name = name
+        self.lookback = lookback
+        self.lead = lead
+        self.flat = flat
+        # year blocks served from the cache / built (partly or directly)
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def _path(self,year,key=None):
+        name = self.name+'-'+str(year)
+        return os.path.join(self.folder,name+'.npz' if key is None else name+'-'+key+'.npy')
+
+    def _load(self,year):
+        # ((x memory-mapped, day, ticker, tickers, dates), {ticker: hash})
+        path = self._path(year)
+        if not os.path.exists(path):
+            return None,{}
+        with np.load(path,allow_pickle=False) as f:
+            try:
+                x = np.load(self._path(year,str(f['key'])),mmap_mode='r')
+            except FileNotFoundError:
+                # replaced by another process between the two reads
+                return None,{}
+            block = x,f['day'],f['ticker'],list(f['tickers']),f['dates']
+            return block,dict(zip(f['tickers'],f['hashes']))
+
+    def _save(self,year,shape,fill,day,ticker,dates,tickers,hashes):
+        # fill(x) writes the features straight into the .npy map of `shape`,
+        # which is returned still mapped
+        hashes = [hashes[t] for t in tickers]
+        key = _digest(*hashes)[:10]
+        with atomic_path(self._path(year,key)) as tmp:
+            x = np.lib.format.open_memmap(tmp,'w+','float32',shape)
+            fill(x)
+            x.flush()
+        with atomic_path(self._path(year)) as tmp:
+            np.savez(tmp,key=key,day=day,ticker=ticker,dates=np.asarray(dates).astype(str),
+                     tickers=np.asarray(tickers).astype(str),hashes=np.array(hashes))
+        for path in glob.glob(self._path(year,'*')):
+            if path != self._path(year,key):
+                os.remove(path)
+        return x
+
+    def _hashes(self,frames,tickers,rows,code):
+        dates = frames[0]['Date'].to_numpy()[rows].astype(str)
+        cols = [np.ascontiguousarray(f[tickers].iloc[rows].to_numpy(dtype='float64').T) for f in frames]
+        head = _digest(code,'\0'.join(dates))
+        return {t:_digest(head,*[c[i].tobytes() for c in cols]) for i,t in enumerate(tickers)}
+
+    def _build(self,frames,tickers,rows,lo,hi,build):
+        # feature values and the samples on rows lo to hi, from the frames'
+        # `rows`; day indexes `rows`, ticker `tickers`
+        families = build(*[f.iloc[rows] for f in frames],tickers)
+        ok = np.ones(families[0][1].shape,dtype=bool)
+        for _,complete in families:
+            ok &= complete
+        ok[:lo-rows.start] = False
+        ok[hi-rows.start:] = False
+        t,j = sample_index(ok)
+        return [vals for vals,_ in families],t,j
+
+    def _shape(self,vals):
+        # one sample's features: (lags, features), or flat (features*lags)
+        n_lags = vals[0].shape[-1]
+        return (len(vals)*n_lags,) if self.flat else (n_lags,len(vals))
+
+    def _gather(self,vals,t,j,out=None):
+        # features.gather into out, through a (samples, lags, features) view
+        # of the family-major flat layout
+        if out is None:
+            out = np.empty((len(t),)+self._shape(vals),dtype='float32')
+        if self.flat:
+            gather(vals,t,j,out.reshape(len(t),len(vals),vals[0].shape[-1]).transpose(0,2,1))
+        else:
+            gather(vals,t,j,out)
+        return out
+
+    def samples(self,frames,label,tickers,years,build,returns,out=None):
+        # frames: Date+ticker DataFrames of one window, label: the label matrix
+        # aligned with their rows, build(*frames,tickers) -> feature families
+        # and returns(*frames,tickers) -> the R-future matrix, as
+        # create_stock_data uses them. Returns the samples of `years` for
+        # `tickers` in the ticker-major row order of build_samples, with x
+        # written into out(shape, dtype) if given (e.g. lstm_input.spill.array).
+        tickers = list(tickers)
+        code = _digest(_source(build),_source(features),self.flat)
+        dates = frames[0]['Date'].to_numpy()
+        year = frames[0]['Date'].str[:4].astype(int).to_numpy()
+        targets = returns(*frames,tickers),label[tickers].to_numpy(dtype='float64')
+        parts = []
+        for y in years:
+            lo,hi = np.searchsorted(year,[y,y+1])
+            if lo == hi:
+                continue
+            if lo < self.lookback or hi+self.lead > len(year):
+                rows = slice(max(lo-self.lookback,0),min(hi+self.lead,len(year)))
+                vals,t,j = self._build(frames,tickers,rows,lo,hi,build)
+                parts.append((self._gather(vals,t,j),np.arange(len(t)),t+rows.start,j))
+                self.misses += 1
+                continue
+            rows = slice(lo-self.lookback,hi+self.lead)
+            hashes = self._hashes(frames,tickers,rows,code)
+            block,known = self._load(y)
+            missing = [t for t in tickers if known.get(t) != hashes[t]]
+            if missing:
+                vals,t,j = self._build(frames,missing,rows,lo,hi,build)
+                day,ticker,names,old = t,j,missing,np.zeros(0,dtype='int64')
+                if block is not None and np.array_equal(block[4],dates[rows].astype(str)):
+                    # the block's other tickers stay, ahead of the rebuilt ones
+                    old_x,old_day,old_ticker,old_names,_ = block
+                    keep = [t for t in old_names if t not in missing]
+                    remap = _codes(old_names,keep)[old_ticker]
+                    old = np.flatnonzero(remap >= 0)
+                    day = np.concatenate([old_day[old],t])
+                    ticker = np.concatenate([remap[old],len(keep)+j])
+                    names = keep+missing
+                    known = {t:known[t] for t in keep}
+                else:
+                    known = {}
+                known.update(hashes)
+
+                def fill(x):
+                    if len(old):
+                        _copy(x,np.arange(len(old)),old_x,old)
+                    self._gather(vals,t,j,x[len(old):])
+
+                x = self._save(y,(len(day),)+self._shape(vals),fill,day,ticker,dates[rows],names,known)
+                block = x,day,ticker,names,None
+                self.misses += 1
+            else:
+                self.hits += 1
+            x,day,ticker,names,_ = block
+            j = _codes(names,tickers)[ticker]
+            sel = np.flatnonzero(j >= 0)
+            parts.append((x,sel,day[sel]+rows.start,j[sel]))
+        return self._assemble(parts,targets,dates,tickers,out)
+
+    def _assemble(self,parts,targets,dates,tickers,out=None):
+        # the rows with a return and a label, sorted by ticker, then day
+        future,label = targets
+        rows,days,codes = [],[],[]
+        for x,sel,t,j in parts:
+            ok = ~np.isnan(future[t,j]) & ~np.isnan(label[t,j])
+            rows.append(sel[ok])
+            days.append(t[ok])
+            codes.append(j[ok])
+        t,j = np.concatenate(days),np.concatenate(codes)
+        order = np.lexsort((t,j))
+        dest = np.empty(len(order),dtype='int64')
+        dest[order] = np.arange(len(order))
+        x = (np.empty if out is None else out)((len(order),)+parts[0][0].shape[1:],'float32')
+        start = 0
+        for (block,*_),r in zip(parts,rows):
+            _copy(x,dest[start:start+len(r)],block,r)
+            start += len(r)
+        t,j = t[order],j[order]
+        return SampleStore(x,t,j,future[t,j],label[t,j],dates,tickers)
@@ -0,0 +1,47 @@
+import numpy as np
+
+# The one cleaning stage between downloaded prices and everything downstream.
+# A (date, ticker) cell is valid when every field (Open, Close) is finite and
+# positive. Data from the old downloader also carries its stand-ins (missing
+# as 0, Open 0 replaced by 3): PLACEHOLDERS is passed for those legacy CSVs
+# only, since a genuine open of 3.00 is a real price elsewhere. Invalid cells inside a ticker's listed span are
+# filled with the ticker's last valid price so that its feature windows stay
+# complete, and everything before its first or after its last valid day is
+# NaN. The validity mask is kept next to the prices: the labels are NaN on
+# invalid days, so no sample is ever trained or traded on a filled price.
+# Prices come out as float32, free of 0, inf and NaN inside the span, so the
+# features need no coercion or clipping afterwards.
+
+PLACEHOLDERS = {'Open':3.}
+
+
+def valid_mask(fields,placeholders=None):
+    # fields: {name: (dates x tickers) array}
+    valid = None
+    for name,values in fields.items():
+        values = np.asarray(values,dtype='float64')
+        ok = np.isfinite(values) & (values > 0)
+        if placeholders and name in placeholders:
+            ok &= values != placeholders[name]
+        valid = ok if valid is None else valid & ok
+    return valid
+
+
+def fill_span(values,valid):
+    # forward fill invalid cells from the last valid one of the same ticker;
+    # NaN before the first and after the last valid cell
+    rows = np.arange(len(values))[:,None]
+    last = np.maximum.accumulate(np.where(valid,rows,-1),axis=0)
+    out = values[np.maximum(last,0),np.arange(values.shape[1])].astype('float32')
+    after = rows > np.where(valid.any(axis=0),len(values)-1-np.argmax(valid[::-1],axis=0),-1)
+    out[(last < 0) | after] = np.nan
+    return out
+
+
+def clean_prices(fields,valid=None,placeholders=None):
+    # ({name: float32 prices}, valid); a given valid mask is combined with
+    # the checks, so cleaning an already clean store changes nothing
+    mask = valid_mask(fields,placeholders)
+    if valid is not None:
+        mask &= np.asarray(valid,dtype=bool)
+    return {name:fill_span(np.asarray(values),mask) for name,values in fields.items()},mask
@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import pandas as pd
+from cache import _digest
+from outputs import atomic_path
+
+# S&P 500 membership as a months x tickers boolean matrix instead of a dict of
+# per-month ticker sets. Rows are the 'YYYY-MM' columns of data/SPXconst.csv,
+# columns the sorted tickers; member[m, j] says ticker j was in the index in
+# month m. The matrix is built from the CSV once and kept bit-packed in
+# cache/constituents.npz, rebuilt whenever the CSV changes.
+
+
+class ConstituentIndex:
+    def __init__(self,months,tickers,member):
+        self.months = np.asarray(months).astype(str)
+        self.tickers = np.asarray(tickers).astype(str)
+        self.member = np.asarray(member,dtype=bool)
+        self.code = {t:i for i,t in enumerate(self.tickers)}
+
+    def row(self,month):
+        # 'YYYY-MM' (or a longer date string / datetime64) -> row number
+        i = int(np.searchsorted(self.months,_month(month)))
+        if i == len(self.months) or self.months[i] != _month(month):
+            raise KeyError(month)
+        return i
+
+    def rows(self,first,last):
+        # months first..last, both included
+        return slice(np.searchsorted(self.months,_month(first)),
+                     np.searchsorted(self.months,_month(last),side='right'))
+
+    def _names(self,mask,among):
+        names = self.tickers[mask]
+        if among is not None:
+            names = names[np.isin(names,np.asarray(among).astype(str))]
+        return names.tolist()
+
+    def members(self,month,among=None):
+        # sorted tickers in the index in `month`, optionally only those in `among`
+        return self._names(self.member[self.row(month)],among)
+
+    def union(self,first,last,among=None):
+        # sorted tickers in the index in any month first..last
+        return self._names(self.member[self.rows(first,last)].any(axis=0),among)
+
+    def mask(self,dates,tickers=None):
+        # (dates x tickers) membership of each date's month; tickers missing
+        # from the index are never members
+        months = _months(dates)
+        rows = np.minimum(np.searchsorted(self.months,months),len(self.months)-1)
+        known = self.months[rows] == months
+        out = self.member[rows] & known[:,None]
+        if tickers is None:
+            return out
+        cols = np.array([self.code.get(t,-1) for t in tickers],dtype='int64')
+        return np.where(cols >= 0,out[:,cols],False)
+
+
+def _month(date):
+    if isinstance(date,np.datetime64):
+        return str(date.astype('datetime64[M]'))
+    return str(date)[:7]
+
+
+def _months(dates):
+    dates = np.asarray(dates)
+    if dates.dtype.kind == 'M':
+        return dates.astype('datetime64[M]').astype(str)
+    return dates.astype(str).astype('U7')
+
+
+def from_csv(path='data/SPXconst.csv'):
+    # one column of tickers per month; 'MM/YYYY' headers are accepted too
+    df = pd.read_csv(path)
+    months = ['-'.join(col.split('/')[::-1]) for col in df.columns]
+    tickers = np.unique(df.melt()['value'].dropna().astype(str).to_numpy())
+    member = np.zeros((len(months),len(tickers)),dtype=bool)
+    for i,col in enumerate(df.columns):
+        member[i,np.searchsorted(tickers,df[col].dropna().astype(str).to_numpy())] = True
+    order = np.argsort(months,kind='stable')
+    return ConstituentIndex(np.array(months)[order],tickers,member[order])
+
+
+def load_index(path='data/SPXconst.csv',folder='cache'):
+    stat = os.stat(path)
+    key = _digest(os.path.abspath(path),stat.st_size,stat.st_mtime_ns)
+    cached = os.path.join(folder,'constituents.npz')
+    if os.path.exists(cached):
+        with np.load(cached,allow_pickle=False) as f:
+            if str(f['key']) == key:
+                member = np.unpackbits(f['member'],axis=1,count=len(f['tickers'])).astype(bool)
+                return ConstituentIndex(f['months'],f['tickers'],member)
+    index = from_csv(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    with atomic_path(cached) as tmp:
+        np.savez(tmp,key=key,months=index.months,tickers=index.tickers,
+                 member=np.packbits(index.member,axis=1))
+    return index
@@ -1,46 +1,216 @@
-import yfinance as yf
+import argparse
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
+from constituents import load_index
+from outputs import atomic_open
+from price_store import write_store
 
-spx_const = pd.read_csv('data/SPXconst.csv')
+# Incremental price download. Every ticker's Open/Close history is kept in
+# data/raw/<ticker>.csv, and data/raw/fetched.json records the date range
+# already requested for it. A run works out the range each ticker needs (the
+# four-year windows of the years it is a constituent in), requests only what
+# is missing from the cache, in batches of tickers on a small thread pool
+# with retries, and then writes the price store (data/prices) from the cache.
+# fetched.json keeps a list of fetched [start, end) ranges per ticker, so
+# runs over disjoint years leave the gap between them missing. A ticker the
+# source returns nothing for counts as failed, like a batch that raises: it
+# is retried, then reported and left out of fetched.json for the next run;
+# everything fetched before it stays cached.
+#
+# The source is pluggable: anything with fetch(tickers, start, end) ->
+# {ticker: DataFrame indexed by 'YYYY-MM-DD' with Open/Close columns}, leaving
+# out the tickers it has no rows for.
+# YahooSource downloads with yfinance, CsvSource reads a local fixture folder.
+#
+#   python create_stock_data.py
+#   python create_stock_data.py --source csv --fixture tests/prices --workers 1
 
-#Make datetime and make sure its D/M/Y
-spx_const.columns = pd.to_datetime(spx_const.columns, dayfirst=True)
+FIELDS = ['Open','Close']
 
 
-# Loop over each year from 1990 to 2018 (2019 so it actually runs 2018)
-for year in range(1990, 2019):
-    start_date = f"{year}-01-01"
-    end_date = f"{year + 4}-01-01"
+class YahooSource:
+    def __init__(self,symbol=lambda t: t.replace('.','-')):
+        # symbol: SPXconst ticker -> Yahoo symbol (BRK.B -> BRK-B)
+        self.symbol = symbol
 
-    # SET for uniqueness
-    tickers = set()
-    for month in range(1, 13):
-        date_col = pd.to_datetime(f"{year}-{month:02d}-01")
-        if date_col in spx_const.columns:
-            #Make sure to remove NAN with dropna and grab new values wiht unique
-            tickers.update(spx_const[date_col].dropna().unique())
+    def fetch(self,tickers,start,end):
+        import yfinance as yf
+        symbols = {self.symbol(t):t for t in tickers}
+        data = yf.download(list(symbols),start=start,end=end,group_by='ticker',progress=False,threads=False)
+        out = {}
+        for s,t in symbols.items():
+            if isinstance(data.columns,pd.MultiIndex):
+                if s not in data.columns.get_level_values(0):
+                    continue
+                frame = data[s]
+            else:
+                frame = data
+            # a failed symbol comes back as all-NaN columns, not an error
+            frame = frame[FIELDS].apply(pd.to_numeric,errors='coerce').dropna(how='all')
+            if len(frame):
+                frame.index = pd.to_datetime(frame.index).strftime('%Y-%m-%d')
+                out[t] = frame
+        return out
 
-    data = yf.download(list(tickers), start=start_date, end=end_date, group_by='ticker')
 
-    op = pd.DataFrame({ticker: pd.to_numeric(data[ticker]['Open'], errors='coerce').ffill().fillna(0) for ticker in tickers})
-    cp = pd.DataFrame({ticker: pd.to_numeric(data[ticker]['Close'], errors='coerce').ffill().fillna(0) for ticker in tickers})
+class CsvSource:
+    def __init__(self,folder):
+        # <folder>/<ticker>.csv with Date, Open, Close columns
+        self.folder = folder
 
-    #Need this for formatting correctness
-    op.index = pd.to_datetime(op.index).strftime('%Y-%m-%d')
-    cp.index = pd.to_datetime(cp.index).strftime('%Y-%m-%d')
+    def fetch(self,tickers,start,end):
+        out = {}
+        for t in tickers:
+            path = os.path.join(self.folder,t+'.csv')
+            if os.path.exists(path):
+                frame = pd.read_csv(path,index_col='Date',float_precision='round_trip')[FIELDS]
+                frame = frame[(frame.index >= start) & (frame.index < end)]
+                if len(frame):
+                    out[t] = frame
+        return out
 
-    #AVOID DIV BY 0
-    op.replace(0, 3, inplace=True)
 
-    #Make sure we have the data in the YMD format in the first column
-    op.reset_index(inplace=True)
-    cp.reset_index(inplace=True)
-    op.rename(columns={'index': 'Date'}, inplace=True)
-    cp.rename(columns={'index': 'Date'}, inplace=True)
+class TickerCache:
+    def __init__(self,folder='data/raw'):
+        self.folder = folder
+        self.path = os.path.join(folder,'fetched.json')
+        self.lock = threading.Lock()
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.fetched = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                # {ticker: [[start, end], ...]}; older files hold one [start, end]
+                self.fetched = {t:[r] if isinstance(r[0],str) else r for t,r in json.load(f).items()}
 
+    def _file(self,ticker):
+        return os.path.join(self.folder,ticker+'.csv')
 
-    op.to_csv(f"data/Open-{year}.csv", index=False)
-    cp.to_csv(f"data/Close-{year}.csv", index=False)
+    def missing(self,ticker,start,end):
+        # the parts of [start, end) outside every fetched range
+        out = []
+        for first,last in self.fetched.get(ticker,[]):
+            if first > start:
+                out.append((start,min(end,first)))
+            start = max(start,last)
+            if start >= end:
+                break
+        if start < end:
+            out.append((start,end))
+        return [r for r in out if r[0] < r[1]]
 
+    def frame(self,ticker):
+        if not os.path.exists(self._file(ticker)):
+            return pd.DataFrame(columns=FIELDS,dtype='float64')
+        return pd.read_csv(self._file(ticker),index_col='Date',float_precision='round_trip')
 
+    def add(self,ticker,frame,start,end):
+        # merge newly fetched rows and record [start, end) as fetched
+        with self.lock:
+            old = self.frame(ticker)
+            merged = pd.concat([old[~old.index.isin(frame.index)],frame[FIELDS]]).sort_index()
+            merged.index.name = 'Date'
+            with atomic_open(self._file(ticker),newline='') as handle:
+                merged.to_csv(handle)
+            ranges = []
+            for r in sorted(self.fetched.get(ticker,[])+[[start,end]]):
+                if ranges and r[0] <= ranges[-1][1]:
+                    ranges[-1][1] = max(ranges[-1][1],r[1])
+                else:
+                    ranges.append(list(r))
+            self.fetched[ticker] = ranges
+            with atomic_open(self.path) as f:
+                json.dump(self.fetched,f,indent=1,sort_keys=True)
+
+
+def needs(first_year=1990,last_year=2018):
+    # {ticker: (start, end)}: the tickers of every year's constituents need
+    # that year and the three after it, as the four-year windows did
+    index = load_index()
+    out = {}
+    for year in range(first_year,last_year+1):
+        for t in index.union(str(year)+'-01',str(year)+'-12'):
+            start,end = out.get(t,('9999','0000'))
+            out[t] = (min(start,'%d-01-01'%year),max(end,'%d-01-01'%(year+4)))
+    return out
+
+
+def _fetch(source,cache,batch,start,end,retries,backoff):
+    # the tickers still without data after `retries` attempts
+    for attempt in range(retries):
+        if attempt:
+            time.sleep(backoff*2**(attempt-1))
+        try:
+            frames = source.fetch(batch,start,end)
+        except Exception:
+            if attempt == retries-1:
+                raise
+            continue
+        for t in batch:
+            if t in frames:
+                cache.add(t,frames[t],start,end)
+        batch = [t for t in batch if t not in frames]
+        if not batch:
+            break
+    return batch
+
+
+def download(source,cache,ranges,batch_size=50,workers=4,retries=3,backoff=2.):
+    # fetch the missing part of every ticker's range; returns the (tickers,
+    # start, end) that still failed after `retries` attempts
+    groups = {}
+    for t,(start,end) in sorted(ranges.items()):
+        for r in cache.missing(t,start,end):
+            groups.setdefault(r,[]).append(t)
+    jobs = [(tickers[i:i+batch_size],start,end) for (start,end),tickers in sorted(groups.items())
+            for i in range(0,len(tickers),batch_size)]
+    print('Fetching',sum(len(j[0]) for j in jobs),'ticker ranges in',len(jobs),'batches')
+    failed = []
+    with ThreadPoolExecutor(workers) as pool:
+        futures = {pool.submit(_fetch,source,cache,*job,retries,backoff):job for job in jobs}
+        for f in as_completed(futures):
+            batch,start,end = futures[f]
+            if f.exception() is not None:
+                print('Failed',start,end,batch,repr(f.exception()))
+                failed.append((batch,start,end))
+            elif f.result():
+                print('No data',start,end,f.result())
+                failed.append((f.result(),start,end))
+    return failed
+
+
+def build_store(cache,tickers,folder='data/prices'):
+    # dates x tickers Open/Close matrices from the cache; write_store cleans
+    frames = {t:cache.frame(t) for t in tickers}
+    frames = {t:f for t,f in frames.items() if len(f)}
+    tickers = sorted(frames)
+    dates = np.unique(np.concatenate([f.index.to_numpy().astype(str) for f in frames.values()]))
+    fields = {}
+    for name in FIELDS:
+        df = pd.DataFrame({t:frames[t][name] for t in tickers}).reindex(dates)
+        fields[name] = df.to_numpy(dtype='float64')
+    write_store(folder,dates,tickers,fields)
+    print('Stored',len(dates),'dates x',len(tickers),'tickers in',folder)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download the constituents\' prices into data/prices')
+    parser.add_argument('--source',choices=['yahoo','csv'],default='yahoo')
+    parser.add_argument('--fixture',default=None,help='folder of <ticker>.csv files for --source csv')
+    parser.add_argument('--years',type=int,nargs=2,default=[1990,2018],metavar=('FIRST','LAST'))
+    parser.add_argument('--batch-size',type=int,default=50)
+    parser.add_argument('--workers',type=int,default=4)
+    parser.add_argument('--retries',type=int,default=3)
+    args = parser.parse_args()
+    source = YahooSource() if args.source == 'yahoo' else CsvSource(args.fixture)
+    cache = TickerCache()
+    ranges = needs(*args.years)
+    failed = download(source,cache,ranges,args.batch_size,args.workers,args.retries)
+    build_store(cache,ranges)
+    if failed:
+        print(sum(len(f[0]) for f in failed),'ticker ranges failed, rerun to fetch them')
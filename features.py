@@ -0,0 +1,120 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Panel feature engine. Prices come in as (dates x tickers) matrices and every
+# feature family is a (dates x tickers x lags) array -- a sliding-window view
+# for the 240-day sequences, a gathered array for the RF lag sets -- so the
+# features of all tickers are built at once instead of column by column.
+
+
+def panel(df, tickers=None):
+    tickers = list(df.columns[1:]) if tickers is None else list(tickers)
+    return df[tickers].to_numpy(dtype='float64')
+
+
+def shift(arr, k):
+    # pandas .shift(k) along the date axis
+    out = np.full_like(arr, np.nan)
+    if k > 0:
+        out[k:] = arr[:-k]
+    elif k < 0:
+        out[:k] = arr[-k:]
+    else:
+        out[:] = arr
+    return out
+
+
+def ratio(num, den):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return num/den-1
+
+
+def intraday_returns(op, cl):
+    # IntraR: close/open-1 of the same day
+    return ratio(cl, op)
+
+
+def nextday_returns(op, cl):
+    # NextR: next open over today's close
+    return ratio(shift(op, -1), cl)
+
+
+def close_returns(cl, k=1):
+    # CloseR / R: close-to-close return over k days
+    return ratio(cl, shift(cl, k))
+
+
+def windows(series, m=240):
+    # Row t of the view holds series[t-m+1], ..., series[t]; the first m-1 rows
+    # are NaN padded so that the view stays aligned with the date axis.
+    pad = np.full((m-1,)+series.shape[1:], np.nan)
+    return sliding_window_view(np.concatenate([pad, series]), m, axis=0)
+
+
+def complete(series, m=240):
+    # True where the m-day window ending at t has no NaN
+    count = np.cumsum(np.isnan(series), axis=0)
+    count[m:] = count[m:]-count[:-m]
+    ok = count == 0
+    ok[:m-1] = False
+    return ok
+
+
+def window_family(series, m=240):
+    return windows(series, m), complete(series, m)
+
+
+def lag_family(num, den, lags, num_lag=0):
+    # num[t-num_lag]/den[t-k]-1 for every k in lags
+    lags = np.asarray(lags)
+    m = lags.max()+1
+    vals = ratio(shift(num, num_lag)[..., None], windows(den, m)[..., m-1-lags])
+    return vals, ~np.isnan(vals).any(axis=-1)
+
+
+def select_lags(series, lags):
+    # series[t-k] for every k in lags
+    lags = np.asarray(lags)
+    m = lags.max()+1
+    vals = windows(series, m)[..., m-1-lags]
+    return vals, ~np.isnan(vals).any(axis=-1)
+
+
+def sample_index(valid):
+    # Ticker-major order (all days of the first ticker, then the next ...), the
+    # row order the per-ticker loop produced.
+    j, t = np.nonzero(valid.T)
+    return t, j
+
+
+def gather(families, t, j, out=None, chunk=1 << 14):
+    # Stack the families at the sample positions into a float32
+    # (samples, lags, n_features) tensor, or into `out` of that shape (e.g. an
+    # np.lib.format.open_memmap), `chunk` samples at a time.
+    n_lags = families[0].shape[-1]
+    if out is None:
+        out = np.empty((len(t), n_lags, len(families)), dtype='float32')
+    for s in range(0, len(t), chunk):
+        for f, vals in enumerate(families):
+            out[s:s+chunk, :, f] = vals[t[s:s+chunk], j[s:s+chunk]]
+    return out
+
+
+def build_samples(families, future, label, valid=None):
+    # families: list of (values, complete) pairs over the same (dates x tickers)
+    # panel; future/label: (dates x tickers) targets aligned with the rows.
+    ok = ~np.isnan(future) & ~np.isnan(label)
+    if valid is not None:
+        ok &= valid
+    for _, complete_ in families:
+        ok &= complete_
+    t, j = sample_index(ok)
+    X = gather([vals for vals, _ in families], t, j)
+    return X, t, j, future[t, j], label[t, j]
+
+
+def flat(X):
+    # (samples, lags, n_features) -> (samples, n_features*lags), family-major
+    # like the IntraR.../NextR.../CloseR... column blocks
+    return X.transpose(0, 2, 1).reshape(len(X), -1)
+
@@ -0,0 +1,104 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+
+# Per-stage timing of a strategy-year. run_year opens a record with
+# begin(strategy, year), wraps its stages (and the trainers their fit and
+# predict steps) in `with stage(name):`, and end(folder) appends one JSON line
+# to <folder>/timings.jsonl:
+#
+#   {"strategy": .., "year": .., "pid": .., "start": .., "wall": ..,
+#    "stages": [{"stage": "load", "wall": s, "cpu": s, "peak_rss_mb": MB}, ..]}
+#
+# cpu is this process's user+system time, threads included but not the
+# separate worker processes joblib may start. peak_rss_mb is the peak resident
+# size during the stage where Linux can reset the high-water mark
+# (/proc/self/clear_refs), the process-wide peak so far elsewhere. Outside a
+# begin/end pair stage() only runs its block.
+#
+#   python instrument.py results-Intraday-240-1-RF
+# sums the stages over all recorded years.
+
+_record = None
+
+
+def _reset_peak():
+    try:
+        with open('/proc/self/clear_refs','w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])/1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak/(1024*1024) if sys.platform == 'darwin' else peak/1024
+
+
+def begin(strategy,year):
+    global _record
+    _record = {'strategy':strategy,'year':int(year),'pid':os.getpid(),'start':time.time(),
+               'stages':[],'_wall':time.perf_counter()}
+    return _record
+
+
+@contextlib.contextmanager
+def stage(name):
+    if _record is None:
+        yield
+        return
+    _reset_peak()
+    wall,cpu = time.perf_counter(),time.process_time()
+    try:
+        yield
+    finally:
+        _record['stages'].append({'stage':name,'wall':time.perf_counter()-wall,
+                                  'cpu':time.process_time()-cpu,'peak_rss_mb':_peak_rss_mb()})
+
+
+def end(folder):
+    # append the record to <folder>/timings.jsonl and close it
+    global _record
+    record,_record = _record,None
+    if record is None:
+        return None
+    record['wall'] = time.perf_counter()-record.pop('_wall')
+    with open(os.path.join(folder,'timings.jsonl'),'a') as f:
+        f.write(json.dumps(record)+'\n')
+    return record
+
+
+def read(folder):
+    with open(os.path.join(folder,'timings.jsonl')) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summary(folder):
+    # {stage: (total wall, total cpu, max peak RSS)} over the latest record of
+    # every year
+    latest = {r['year']:r for r in read(folder)}
+    out = {}
+    for r in latest.values():
+        for s in r['stages']:
+            wall,cpu,peak = out.get(s['stage'],(0.,0.,0.))
+            out[s['stage']] = (wall+s['wall'],cpu+s['cpu'],max(peak,s['peak_rss_mb']))
+    return out
+
+
+if __name__ == '__main__':
+    for folder in sys.argv[1:]:
+        print(folder)
+        for name,(wall,cpu,peak) in summary(folder).items():
+            print('%-18s wall %10.2fs  cpu %10.2fs  peak %8.0f MB'%(name,wall,cpu,peak))
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+
+def rank_first(ret):
+    # Row-wise rank(method='first'): NaNs sort last, ties keep column order.
+    order = np.argsort(ret, axis=1, kind='stable')
+    ranks = np.empty(ret.shape)
+    np.put_along_axis(ranks, order, np.arange(1., ret.shape[1]+1), axis=1)
+    ranks[np.isnan(ret)] = np.nan
+    return ranks
+
+
+def qcut_labels(ret, perc=[0.5,0.5]):
+    # Same labels as
+    #   ret.apply(lambda x: pd.qcut(x.rank(method='first'),[0.]+cumsum(perc),labels=False), axis=1)
+    # computed for the whole dates x tickers matrix at once. The ranks of a day
+    # with n valid tickers are 1..n, so the qcut bin edges only depend on n and
+    # are computed once per distinct n. Days with too few valid tickers for
+    # distinct edges (where qcut raises) come out as NaN.
+    frame = ret if isinstance(ret, pd.DataFrame) else None
+    ret = np.asarray(ret, dtype='float64')
+    q = np.asarray([0.]+list(np.cumsum(perc)))
+    ranks = rank_first(ret)
+    count = (~np.isnan(ret)).sum(axis=1)
+    label = np.full(ret.shape, np.nan)
+    for n in np.unique(count):
+        if n == 0:
+            continue
+        bins = np.percentile(np.arange(1., n+1), q*100.)
+        if len(np.unique(bins)) < len(bins):
+            continue
+        rows = count == n
+        r = ranks[rows]
+        ids = np.searchsorted(bins, r, side='left')
+        ids[r == bins[0]] = 1
+        codes = (ids-1).astype('float64')
+        codes[np.isnan(r) | (ids == len(bins)) | (ids == 0)] = np.nan
+        label[rows] = codes
+    if not np.isnan(label).any():
+        label = label.astype('int64')
+    if frame is not None:
+        return pd.DataFrame(label, index=frame.index, columns=frame.columns)
+    return label
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import numpy as np
+import tensorflow as tf
+
+# Streaming LSTM training input. The training features are assembled straight
+# into a memory-mapped .npy file (spill), normalized there a chunk at a time
+# (scale), and tf.data gathers each batch from it on the fly, with integer
+# class labels for sparse_categorical_crossentropy. Only row indices are
+# shuffled, so Keras never sees a shuffled copy of the features or a one-hot
+# label matrix, and the training set is never in memory whole: resident
+# memory is the chunks and prefetched batches plus the pages of the map.
+
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+CHUNK_BYTES = 1 << 27
+
+
+class spill:
+    # a temporary <prefix>-*.npy file for one array, deleted when the with
+    # block ends:
+    #   with spill('cache/name-train') as target:
+    #       train_data = feature_cache.samples(...,out=target.array)
+    def __init__(self,prefix):
+        fd,self.path = tempfile.mkstemp(suffix='.npy',prefix=os.path.basename(prefix)+'-',
+                                        dir=os.path.dirname(prefix) or '.')
+        os.close(fd)
+
+    def array(self,shape,dtype='float32'):
+        return np.lib.format.open_memmap(self.path,'w+',dtype,shape)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        os.remove(self.path)
+
+
+def scale(train,test,scaler,chunk_bytes=CHUNK_BYTES):
+    # Fit scaler() on train and scale train and test in place, both seen as
+    # (samples, features) matrices. One scaler is fitted per block of feature
+    # columns and applied a block of rows at a time, so no more than
+    # chunk_bytes of a memory-mapped train is read at once. Column-wise
+    # scalers (StandardScaler, RobustScaler) give the same values as one
+    # scaler fitted and applied on the whole matrix.
+    train,test = train.reshape(len(train),-1),test.reshape(len(test),-1)
+    n,width = train.shape
+    cols = max(1,chunk_bytes//(train.itemsize*max(n,1)))
+    fitted = [(slice(c,c+cols),scaler().fit(train[:,c:c+cols])) for c in range(0,width,cols)]
+    rows = max(1,chunk_bytes//(train.itemsize*width))
+    for x in (train,test):
+        for r in range(0,len(x),rows):
+            for c,s in fitted:
+                x[r:r+rows,c] = s.transform(x[r:r+rows,c])
+
+
+def steps(rows,batch_size):
+    return -(-len(rows)//batch_size)
+
+
+def dataset(x,label,rows,batch_size=512,shuffle=False):
+    # batches of (x[rows], label[rows]), reshuffled every epoch if shuffle;
+    # repeats forever, so fit needs steps_per_epoch / validation_steps
+    shape = (None,)+x.shape[1:]
+
+    def gather(idx):
+        idx = np.sort(idx)   # sequential reads from the memory map
+        return x[idx],label[idx].astype('int32')
+
+    def fetch(idx):
+        bx,by = tf.numpy_function(gather,[idx],[tf.float32,tf.int32])
+        bx.set_shape(shape)
+        by.set_shape((None,))
+        return bx,by
+
+    ds = tf.data.Dataset.from_tensor_slices(np.asarray(rows,dtype='int64'))
+    if shuffle:
+        ds = ds.shuffle(len(rows),reshuffle_each_iteration=True)
+    return ds.batch(batch_size).repeat().map(fetch,num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+
+
+def stream(store,validation_split=0.2,batch_size=512):
+    # model.fit(**stream(train_data), epochs=..., callbacks=...): the rows are
+    # permuted with np.random.permutation, and the last validation_split of
+    # them validates, as Keras' validation_split did on the shuffled arrays
+    rows = np.random.permutation(len(store))
+    split = int(len(rows)*(1.-validation_split))
+    train,val = rows[:split],rows[split:]
+    return {'x':dataset(store.x,store.label,train,batch_size,True),
+            'steps_per_epoch':steps(train,batch_size),
+            'validation_data':dataset(store.x,store.label,val,batch_size,False),
+            'validation_steps':steps(val,batch_size)}
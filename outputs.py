@@ -0,0 +1,52 @@
+import contextlib
+import json
+import os
+
+# Atomic result files and the per-year completion state of a results folder.
+# Everything a year writes goes to a temporary file next to its target and is
+# renamed over it only once complete, so an interrupted year leaves either the
+# previous file or none. state.json records, per finished year, the config
+# hash it ran under, its output files and its avg_returns.txt block.
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    # temporary name with the same extension (Keras and np.savez go by it)
+    root,ext = os.path.splitext(path)
+    tmp = root+'.'+str(os.getpid())+'.tmp'+ext
+    try:
+        yield tmp
+        os.replace(tmp,path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+@contextlib.contextmanager
+def atomic_open(path,mode='w',**kwargs):
+    with atomic_path(path) as tmp:
+        with open(tmp,mode,**kwargs) as handle:
+            yield handle
+
+
+class YearState:
+    def __init__(self,folder):
+        self.path = os.path.join(folder,'state.json')
+        self.years = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.years = json.load(f)
+
+    def done(self,year,config,outputs):
+        entry = self.years.get(str(year))
+        return (entry is not None and entry['config'] == config
+                and all(os.path.exists(p) for p in outputs))
+
+    def record(self,year,config,outputs,summary):
+        self.years[str(year)] = {'config':config,'outputs':list(outputs),'summary':summary}
+        with atomic_open(self.path) as f:
+            json.dump(self.years,f,indent=1,sort_keys=True)
+
+    def summary(self):
+        # avg_returns.txt: the blocks of all finished years, in year order
+        return ''.join(self.years[y]['summary'] for y in sorted(self.years))
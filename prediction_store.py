@@ -0,0 +1,85 @@
+import glob
+import os
+import re
+import numpy as np
+import pandas as pd
+from outputs import atomic_path
+
+# Per-year predictions as columns instead of pickled {day: ndarray} dicts:
+# results-*/predictions-YYYY.npz holds one row per (date, ticker) of the test
+# year with the predicted probability and the realized return, ticker codes
+# indexing the file's own ticker table. load_predictions stacks any set of
+# strategies and years into one Predictions store.
+
+
+def save_predictions(path,test_data,prob):
+    # prob: row-aligned with test_data (e.g. test_data.from_days(predictions));
+    # rows are written day by day, tickers in test_data order within a day
+    order = test_data.day_index()[0]
+    with atomic_path(path) as tmp:
+        np.savez(tmp,date=test_data.dates[test_data.day[order]].astype('datetime64[D]'),
+                 ticker=test_data.ticker[order],prob=np.asarray(prob,dtype='float64')[order],
+                 ret=test_data.ret[order],tickers=test_data.tickers.astype(str))
+
+
+class Predictions:
+    # strategy: int8 index into `strategies`, date: datetime64[D],
+    # ticker: int16 index into `tickers`, prob, ret: float64
+    def __init__(self,strategy,date,ticker,prob,ret,strategies,tickers):
+        self.strategy = np.asarray(strategy,dtype='int8')
+        self.date = np.asarray(date,dtype='datetime64[D]')
+        self.ticker = np.asarray(ticker,dtype='int16')
+        self.prob = np.asarray(prob,dtype='float64')
+        self.ret = np.asarray(ret,dtype='float64')
+        self.strategies = list(strategies)
+        self.tickers = np.asarray(tickers)
+
+    def __len__(self):
+        return len(self.prob)
+
+    def take(self,idx):
+        return Predictions(self.strategy[idx],self.date[idx],self.ticker[idx],self.prob[idx],
+                           self.ret[idx],self.strategies,self.tickers)
+
+    def select(self,strategy):
+        return self.take(self.strategy == self.strategies.index(strategy))
+
+    def matrices(self):
+        # dates and (days x tickers) probability and return matrices, NaN
+        # where a ticker has no prediction; one strategy at a time
+        if len(np.unique(self.strategy)) > 1:
+            raise ValueError('matrices() needs a single strategy, use select()')
+        dates,day = np.unique(self.date,return_inverse=True)
+        prob = np.full((len(dates),len(self.tickers)),np.nan)
+        ret = np.full(prob.shape,np.nan)
+        prob[day,self.ticker] = self.prob
+        ret[day,self.ticker] = self.ret
+        return dates,prob,ret
+
+    def frame(self):
+        return pd.DataFrame({'Strategy':pd.Categorical.from_codes(self.strategy,self.strategies),
+                             'Date':self.date,
+                             'Ticker':pd.Categorical.from_codes(self.ticker,self.tickers),
+                             'Prob':self.prob,'Return':self.ret})
+
+
+def load_predictions(folders,years=None):
+    # every predictions-YYYY.npz of the given results folders (optionally only
+    # `years`), stacked with ticker codes remapped onto one shared table
+    parts = []
+    for s,folder in enumerate(folders):
+        for path in sorted(glob.glob(os.path.join(folder,'predictions-*.npz'))):
+            year = int(re.findall(r'predictions-(\d{4})\.npz$',path)[0])
+            if years is not None and year not in years:
+                continue
+            with np.load(path,allow_pickle=False) as f:
+                parts.append((s,f['date'],f['ticker'],f['prob'],f['ret'],f['tickers']))
+    if not parts:
+        return Predictions([],[],[],[],[],folders,[])
+    tickers = np.unique(np.concatenate([p[5] for p in parts]))
+    return Predictions(np.concatenate([np.full(len(p[1]),p[0]) for p in parts]),
+                       np.concatenate([p[1] for p in parts]),
+                       np.concatenate([np.searchsorted(tickers,p[5])[p[2]] for p in parts]),
+                       np.concatenate([p[3] for p in parts]),
+                       np.concatenate([p[4] for p in parts]),
+                       folders,tickers)
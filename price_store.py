@@ -0,0 +1,121 @@
+import glob
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+from cleaning import PLACEHOLDERS, clean_prices
+
+# One dates x tickers matrix per price field (data/prices/Open.npy,
+# Close.npy) with the date and ticker indices next to it, replacing the
+# overlapping four-year data/Open-YYYY.csv / Close-YYYY.csv windows. Fields are
+# memory-mapped, so a date range is a view of the file and nothing is parsed.
+# Prices are written through cleaning.py: float32, with Valid.npy marking the
+# cells that hold an observed price (python price_store.py --clean converts
+# a store written before that).
+
+
+class PriceStore:
+    def __init__(self,folder='data/prices'):
+        self.folder = folder
+        self.dates = np.load(os.path.join(folder,'dates.npy'))
+        self.tickers = np.load(os.path.join(folder,'tickers.npy'))
+        self.code = {t:i for i,t in enumerate(self.tickers)}
+        self._fields = {}
+
+    def field(self,name):
+        if name not in self._fields:
+            self._fields[name] = np.load(os.path.join(self.folder,name+'.npy'),mmap_mode='r')
+        return self._fields[name]
+
+    def rows(self,start=None,end=None):
+        # dates in [start, end); 'YYYY', 'YYYY-MM' and 'YYYY-MM-DD' all work
+        lo = 0 if start is None else np.searchsorted(self.dates,start)
+        hi = len(self.dates) if end is None else np.searchsorted(self.dates,end)
+        return slice(lo,hi)
+
+    def columns(self,tickers=None):
+        # a slice when the tickers are a contiguous run of the index (view),
+        # an index array otherwise
+        if tickers is None:
+            return slice(None)
+        cols = np.array([self.code[t] for t in tickers],dtype='int64')
+        if len(cols) and np.all(np.diff(cols) == 1):
+            return slice(cols[0],cols[-1]+1)
+        return cols
+
+    def read(self,name,start=None,end=None,tickers=None):
+        return self.field(name)[self.rows(start,end)][:,self.columns(tickers)]
+
+    def frame(self,name,start=None,end=None,tickers=None):
+        # Date + ticker columns, the layout of the old CSV files
+        rows = self.rows(start,end)
+        tickers = list(self.tickers) if tickers is None else [t for t in tickers if t in self.code]
+        df = pd.DataFrame(self.read(name,start,end,tickers),columns=tickers,copy=False)
+        df.insert(0,'Date',self.dates[rows].astype(object))
+        return df
+
+    def window(self,year,tickers=None,names=('Open','Close'),years=4):
+        # what data/<name>-<year>.csv held: `years` calendar years from `year`
+        return [self.frame(n,str(year),str(year+years),tickers) for n in names]
+
+
+def write_store(folder,dates,tickers,fields,valid=None,placeholders=None):
+    # fields go through cleaning.clean_prices: float32 prices plus Valid.npy;
+    # placeholders only for data from the old downloader
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    fields,valid = clean_prices(fields,valid,placeholders)
+    np.save(os.path.join(folder,'dates.npy'),np.asarray(dates,dtype='U10'))
+    np.save(os.path.join(folder,'tickers.npy'),np.asarray(tickers,dtype=str))
+    for name,values in fields.items():
+        np.save(os.path.join(folder,name+'.npy'),values)
+    np.save(os.path.join(folder,'Valid.npy'),valid)
+
+
+def clean_store(folder='data/prices',names=('Open','Close')):
+    # rewrite a store through the cleaning stage, e.g. one written before it
+    # existed; an existing Valid mask is kept, and a store without one is
+    # legacy data, checked for the old downloader's placeholders
+    store = PriceStore(folder)
+    fields = {n:np.array(store.field(n)) for n in names}
+    path = os.path.join(folder,'Valid.npy')
+    valid = np.load(path) if os.path.exists(path) else None
+    store._fields = {}
+    write_store(folder,store.dates,store.tickers,fields,valid,None if valid is not None else PLACEHOLDERS)
+    print('Cleaned',folder)
+
+
+def convert_csvs(data='data',folder='data/prices',names=('Open','Close')):
+    # Merge the overlapping per-year CSV windows into one store. Every
+    # (date, ticker) is taken from the oldest window holding it, i.e. the one
+    # with the most history before that date; later windows only fill in
+    # tickers the older ones did not have.
+    fields = {}
+    for name in names:
+        files = sorted(glob.glob(os.path.join(data,name+'-*.csv')),
+                       key=lambda f: int(re.findall(r'-(\d{4})\.csv$',f)[0]))
+        fields[name] = [pd.read_csv(f) for f in files]
+    frames = [df for dfs in fields.values() for df in dfs]
+    dates = np.unique(np.concatenate([df['Date'].to_numpy().astype(str) for df in frames]))
+    tickers = sorted(set(c for df in frames for c in df.columns[1:]))
+    code = {t:i for i,t in enumerate(tickers)}
+    out = {}
+    for name,dfs in fields.items():
+        values = np.full((len(dates),len(tickers)),np.nan)
+        for df in dfs:
+            r = np.searchsorted(dates,df['Date'].to_numpy().astype(str))
+            c = np.array([code[t] for t in df.columns[1:]])
+            block = values[np.ix_(r,c)]
+            new = df.iloc[:,1:].to_numpy(dtype='float64')
+            values[np.ix_(r,c)] = np.where(np.isnan(block),new,block)
+        out[name] = values
+    write_store(folder,dates,tickers,out,placeholders=PLACEHOLDERS)
+    print('Stored',len(dates),'dates x',len(tickers),'tickers in',folder)
+
+
+if __name__ == '__main__':
+    if '--clean' in sys.argv:
+        clean_store()
+    else:
+        convert_csvs()
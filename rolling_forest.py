@@ -0,0 +1,129 @@
+import argparse
+import copy
+import json
+import os
+import re
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from cache import _digest
+from outputs import atomic_path
+
+# Rolling random forest. Instead of refitting n_estimators trees on the whole
+# three-year training window every test year, the forest of test year t is
+# the union of one sub-forest per training year t-3, t-2, t-1, each of
+# n_estimators/3 trees grown only on that year's samples. Sub-forests are
+# saved in the cache folder, so moving on to test year t+1 drops the trees of
+# t-3 and grows only those of year t: about a third of a full refit.
+#
+# A year's trees are grown on the samples of the first window that needs them
+# (normally the one where it is the newest training year) and then reused as
+# they are, so rolling studies run their test years serially. The file names
+# carry a key of the tree parameters and of `config`, the scheduler's hash of
+# the script, the shared modules, the constituents file and the price store,
+# so trees grown on older data or code are never reused. Delete
+# cache/<name>-trees-* to regrow everything.
+#
+#   python rolling_forest.py results-Intraday-240-1-RF
+# compares a full-refit results folder with its -rolling counterpart, and
+#   python rolling_forest.py results-Intraday-240-1-LSTM --warm
+# a cold-started LSTM study with its -warm one.
+
+RF_COLUMNS = ['Mean','Sharpe','Fit time','Trees grown']
+LSTM_COLUMNS = ['Mean','Sharpe','Epochs','Train time']
+
+
+class RollingForest:
+    def __init__(self,folder,name,n_estimators=1000,years=3,random_state=0,config='',**params):
+        self.folder = folder
+        self.name = name
+        self.years = years
+        self.trees = -(-n_estimators//years)
+        self.random_state = random_state
+        self.params = params
+        # n_jobs only changes how fast trees grow, not which
+        self.key = _digest(self.trees,random_state,config,
+                           sorted((k,v) for k,v in params.items() if k != 'n_jobs'))[:10]
+        self.grown = 0
+
+    def _path(self,year):
+        return os.path.join(self.folder,self.name+'-trees-'+str(year)+'-'+self.key+'.joblib')
+
+    def sub_forest(self,year,x,y):
+        # the trees of one training year, grown on (x, y) unless already saved
+        path = self._path(year)
+        if os.path.exists(path):
+            return joblib.load(path)
+        forest = RandomForestClassifier(n_estimators=self.trees,random_state=self.random_state+year,
+                                        **self.params)
+        forest.fit(x,y)
+        with atomic_path(path) as tmp:
+            joblib.dump(forest,tmp)
+        self.grown += self.trees
+        return forest
+
+    def fit(self,x,y,sample_years,test_year):
+        # x, y: the training samples, sample_years: their calendar years
+        self.grown = 0
+        forests = []
+        for year in range(test_year-self.years,test_year):
+            rows = sample_years == year
+            if os.path.exists(self._path(year)) or rows.any():
+                forests.append(self.sub_forest(year,x[rows],y[rows]))
+        return combine(forests)
+
+
+def combine(forests):
+    # one classifier voting over the trees of all sub-forests
+    classes = forests[0].classes_
+    for f in forests[1:]:
+        if not np.array_equal(f.classes_,classes):
+            raise ValueError('sub-forests were grown on different classes')
+    forest = copy.copy(forests[0])
+    forest.estimators_ = [t for f in forests for t in f.estimators_]
+    forest.n_estimators = len(forest.estimators_)
+    return forest
+
+
+def _metrics(folder):
+    # {year: {'Mean': .., 'Sharpe': .., 'Fit time': .., ..}} from state.json
+    with open(os.path.join(folder,'state.json')) as f:
+        years = json.load(f)
+    out = {}
+    for year,entry in years.items():
+        lines = re.findall(r'^(.+?) = ([-+.\deE]+|nan|inf)',entry['summary'],re.M)
+        out[int(year)] = {k:float(v) for k,v in lines}
+    return out
+
+
+def compare(folder,other=None,cols=RF_COLUMNS,names=('full','rolling')):
+    # per-year metrics `cols` of a study next to its variant in `other`
+    # (default <folder>-<names[1]>): a full refit against its rolling forest,
+    # or cold against warm-started LSTMs with LSTM_COLUMNS and ('cold','warm').
+    # Written to <other>/compare-<names[1]>.csv
+    other = folder+'-'+names[1] if other is None else other
+    base,variant = _metrics(folder),_metrics(other)
+    years = sorted(set(base) & set(variant))
+    rows = [['Year']+[c+' '+m for c in cols for m in names]]
+    for year in years:
+        rows.append([str(year)]+[str(d[year].get(c,np.nan)) for c in cols for d in (base,variant)])
+    with open(os.path.join(other,'compare-'+names[1]+'.csv'),'w') as f:
+        f.write('\n'.join(','.join(r) for r in rows)+'\n')
+    for r in rows:
+        print('\t'.join(r))
+    for c in cols:
+        if years and c.endswith('time'):
+            total = [sum(d[y].get(c,np.nan) for y in years) for d in (base,variant)]
+            print(c+', '+names[0]+' / '+names[1]+':',total[0]/total[1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare a study with its -rolling (RF) or -warm (LSTM) run')
+    parser.add_argument('folder')
+    parser.add_argument('other',nargs='?',default=None)
+    parser.add_argument('--warm',action='store_true',help='LSTM study against its warm-started run')
+    args = parser.parse_args()
+    if args.warm:
+        compare(args.folder,args.other,LSTM_COLUMNS,('cold','warm'))
+    else:
+        compare(args.folder,args.other)
@@ -0,0 +1,31 @@
+import argparse
+import scheduler
+
+# Runs any subset of the six strategies in one process. The scripts are loaded
+# side by side and share shared_data, so SPXconst is read once, and each test
+# year's price window and label matrices are prepared once and handed to every
+# strategy before moving on to the next year. Outputs, state and resume go
+# through scheduler.run, exactly as when a script is run on its own.
+#
+#   python run_strategies.py
+#   python run_strategies.py Intraday-240,1-RF NextDay-240,1-RF --years 2000 2005
+
+STRATEGIES = ['Intraday-240,1-LSTM','Intraday-240,1-RF','Intraday-240,3-LSTM',
+              'Intraday-240,3-RF','NextDay-240,1-LSTM','NextDay-240,1-RF']
+
+
+def run(names=STRATEGIES,years=scheduler.YEARS,force=False):
+    modules = [scheduler.load(name if name.endswith('.py') else name+'.py') for name in names]
+    for test_year in years:
+        for module in modules:
+            scheduler.run(module,[test_year],force=force)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run several strategies over shared data')
+    parser.add_argument('strategies',nargs='*',default=STRATEGIES)
+    parser.add_argument('--years',type=int,nargs=2,default=[scheduler.YEARS[0],scheduler.YEARS[-1]],
+                        metavar=('FIRST','LAST'))
+    parser.add_argument('--force',action='store_true',help='rerun finished years')
+    args = parser.parse_args()
+    run(args.strategies,range(args.years[0],args.years[1]+1),args.force)
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class SampleStore:
+    # Columnar train/test samples: a contiguous float32 feature block plus
+    # int32 day indices into `dates` and int16 ticker codes into `tickers`,
+    # replacing the object arrays of Date, Name, features, future, label rows.
+    def __init__(self,x,day,ticker,ret,label,dates,tickers):
+        self.x = np.ascontiguousarray(x,dtype='float32')
+        self.day = np.asarray(day,dtype='int32')
+        self.ticker = np.asarray(ticker,dtype='int16')
+        self.ret = np.asarray(ret,dtype='float64')
+        self.label = np.asarray(label,dtype='int8')
+        self.dates = np.asarray(dates)
+        self.tickers = np.asarray(tickers)
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def shape(self):
+        return self.x.shape
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.x,self.day,self.ticker,self.ret,self.label))
+
+    def take(self,idx):
+        return SampleStore(self.x[idx],self.day[idx],self.ticker[idx],self.ret[idx],
+                           self.label[idx],self.dates,self.tickers)
+
+    def years(self):
+        return np.array([d[:4] for d in self.dates]).astype(int)[self.day]
+
+    def split(self,test_year):
+        year = self.years()
+        return self.take(year<test_year),self.take(year==test_year)
+
+    def names(self):
+        return self.tickers[self.ticker]
+
+    def day_index(self):
+        # One stable sort by day: order, the days present and the offsets of
+        # each day's block in order. Rows of a day keep their ticker order.
+        order = np.argsort(self.day,kind='stable')
+        days,start = np.unique(self.day[order],return_index=True)
+        return order,days,np.append(start,len(order))
+
+    def by_day(self,values):
+        # split row-aligned values (e.g. one predict call over the whole
+        # store) into the {date: values of that day} dict
+        order,days,offsets = self.day_index()
+        values = np.asarray(values)[order]
+        return {self.dates[d]:values[offsets[i]:offsets[i+1]] for i,d in enumerate(days)}
+
+    def from_days(self,predictions):
+        # inverse of by_day: row-aligned values from a {date: values} dict
+        order,days,offsets = self.day_index()
+        values = np.empty(len(self))
+        values[order] = np.concatenate([predictions[self.dates[d]] for d in days])
+        return values
+
+    def matrix(self,values):
+        # (days x tickers) matrix of row-aligned values, NaN where a ticker
+        # has no sample that day
+        days = np.unique(self.day)
+        out = np.full((len(days),len(self.tickers)),np.nan)
+        out[np.searchsorted(days,self.day),self.ticker] = values
+        return self.dates[days],out
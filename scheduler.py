@@ -0,0 +1,123 @@
+import argparse
+import importlib.util
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from cache import _digest
+from outputs import YearState, atomic_open
+
+# Runs the test years of a strategy script as independent jobs on a process
+# pool. Each worker loads the script once (its module-level setup: SPXconst,
+# folders, caches) and then calls run_year(test_year) for the years it is
+# handed. run_year reseeds at the start of every year, so a year's outputs do
+# not depend on which worker ran it or on how many there are.
+#
+# The study is resumable: a year is recorded in the results folder's
+# state.json when it finishes, and skipped on later runs while its outputs
+# exist and the config hash (script, shared modules, constituents file, price
+# store) is unchanged. avg_returns.txt is rewritten from the recorded years,
+# in year order, after every year.
+#
+#   python scheduler.py Intraday-240,1-RF.py --workers 4
+#   python scheduler.py NextDay-240,1-RF.py --workers 8 --years 2000 2005
+
+YEARS = range(1993,2020)
+# the modules a year's outputs depend on besides its script, hashed by source
+# file so that hashing does not import them (lstm_input pulls in TensorFlow)
+MODULES = ['backtest','cache','cleaning','constituents','features','labels','lstm_input',
+           'prediction_store','price_store','rolling_forest','samples','shared_data','Statistics']
+HERE = os.path.dirname(os.path.abspath(__file__))
+_script = None
+
+
+def load(script):
+    # the scripts' file names (hyphens, commas) are not importable by name
+    name = os.path.splitext(os.path.basename(script))[0].replace('-','_').replace(',','_')
+    spec = importlib.util.spec_from_file_location(name,script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def config(script,folder='data/prices',constituents='data/SPXconst.csv'):
+    # what a year's outputs depend on besides the year itself: the script,
+    # MODULES, the constituents file and the price store in folder
+    parts = []
+    for path in [script]+[os.path.join(HERE,m+'.py') for m in MODULES]+[constituents]:
+        with open(path,'rb') as f:
+            parts.append(f.read())
+    for name in sorted(os.listdir(folder)):
+        stat = os.stat(os.path.join(folder,name))
+        parts.append((name,stat.st_size,stat.st_mtime_ns))
+    return _digest(*parts)
+
+
+def _init(script,threads):
+    global _script
+    _script = script if not isinstance(script,str) else load(script)
+    if threads is not None:
+        _script.N_JOBS = threads
+
+
+def _run(test_year):
+    return test_year,_script.run_year(test_year)
+
+
+def run(script,years=YEARS,workers=1,threads=None,force=False):
+    # script: a path, or the already loaded module of a script run directly.
+    # threads: cores per worker for the random forests, by default the
+    # machine split evenly between the workers
+    module = script if not isinstance(script,str) else load(script)
+    state = YearState(module.result_folder)
+    key = config(module.__file__,module.prices.folder)
+    todo = [y for y in years if force or not state.done(y,key,module.outputs(y))]
+    skipped = [y for y in years if y not in todo]
+    if skipped:
+        print('Skipping finished years',skipped)
+    if (getattr(module,'WARM_START',False) or getattr(module,'ROLLING_FOREST',False)) and workers > 1:
+        print('Warm start / rolling forest chain the years, running them serially')
+        workers = 1
+    if threads is None and workers > 1:
+        threads = max((os.cpu_count() or 1)//workers,1)
+
+    def record(test_year,res):
+        state.record(test_year,key,module.outputs(test_year),res)
+        with atomic_open(module.result_folder+"/avg_returns.txt") as myfile:
+            myfile.write(state.summary())
+
+    if workers <= 1:
+        _init(module,threads)
+        for y in todo:
+            record(*_run(y))
+        return
+    # spawn: TensorFlow and the joblib pools do not survive a fork
+    with ProcessPoolExecutor(workers,mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init,initargs=(module.__file__,threads)) as pool:
+        futures = [pool.submit(_run,y) for y in todo]
+        try:
+            for f in as_completed(futures):
+                record(*f.result())
+        except BaseException:
+            # a failed year stops the study: drop the years not started yet,
+            # the pool then waits for the running ones and shuts down
+            for f in futures:
+                f.cancel()
+            raise
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the test years of a strategy script in parallel')
+    parser.add_argument('script')
+    parser.add_argument('--workers',type=int,default=1)
+    parser.add_argument('--threads',type=int,default=None)
+    parser.add_argument('--years',type=int,nargs=2,default=[YEARS[0],YEARS[-1]],
+                        metavar=('FIRST','LAST'))
+    parser.add_argument('--force',action='store_true',help='rerun finished years')
+    parser.add_argument('--warm-start',action='store_true',help='LSTM scripts: start each year from the previous model')
+    parser.add_argument('--rolling-forest',action='store_true',help='RF scripts: reuse trees of earlier years')
+    args = parser.parse_args()
+    if args.warm_start:
+        os.environ['WARM_START'] = '1'
+    if args.rolling_forest:
+        os.environ['ROLLING_FOREST'] = '1'
+    run(args.script,range(args.years[0],args.years[1]+1),args.workers,args.threads,args.force)
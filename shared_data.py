@@ -0,0 +1,63 @@
+import functools
+import numpy as np
+from constituents import load_index
+from labels import qcut_labels
+from price_store import PriceStore
+
+# The data the six strategy scripts have in common: the SPXconst
+# constituents, the price windows and the two cross-sectional label matrices.
+# Labels are NaN wherever cleaning.py filled a price, which keeps those days
+# out of every sample set.
+# Everything is memoized per process, so scripts loaded into one process (see
+# run_strategies.py) read and label each window once. Callers get the cached
+# objects themselves and must not modify them.
+
+
+@functools.lru_cache(maxsize=None)
+def load_constituents():
+    # a constituents.ConstituentIndex
+    return load_index()
+
+
+@functools.lru_cache(maxsize=None)
+def load_prices():
+    return PriceStore()
+
+
+def window_tickers(test_year):
+    # the tickers create_stock_data.py downloaded for this window
+    return load_constituents().union(str(test_year-3)+'-01',str(test_year-3)+'-12')
+
+
+@functools.lru_cache(maxsize=3)
+def frame(test_year,name):
+    # Date + ticker frame of one price field over the four years ending in test_year
+    return load_prices().frame(name,str(test_year-3),str(test_year+1),window_tickers(test_year))
+
+
+def window(test_year):
+    return frame(test_year,'Open'),frame(test_year,'Close')
+
+
+def valid(test_year):
+    # cleaning.py's mask: True where the day's prices were observed, not filled
+    return frame(test_year,'Valid').iloc[:,1:].to_numpy(dtype=bool)
+
+
+@functools.lru_cache(maxsize=1)
+def intraday_label(test_year,perc=(0.5,0.5)):
+    df_open,df_close = window(test_year)
+    if not np.all(df_close.iloc[:,0]==df_open.iloc[:,0]):
+        print('Date Index issue')
+        return
+    ret = (df_close.iloc[:,1:]/df_open.iloc[:,1:]-1).where(valid(test_year))
+    return qcut_labels(ret,list(perc))
+
+
+@functools.lru_cache(maxsize=1)
+def nextday_label(test_year,perc=(0.5,0.5)):
+    df = frame(test_year,'Close')
+    # the return divides by the previous close, which must be observed too
+    ok = valid(test_year)
+    ok = ok & np.concatenate([ok[:1],ok[:-1]])
+    return qcut_labels(df.iloc[:,1:].pct_change(fill_method=None).where(ok),list(perc))
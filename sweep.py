@@ -0,0 +1,83 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from backtest import long_short
+from outputs import atomic_open
+from prediction_store import load_predictions
+from Statistics import BatchStatistics
+
+# Parameter sweep over stored predictions. The predictions and realized
+# returns of a results folder are loaded once, long_short evaluates every k in
+# one pass, and each (k, cost, long/short mix) daily return series is then a
+# linear combination of the two legs:
+#
+#   daily = w_long*Long + w_short*Short - 2*cost*(w_long + w_short)
+#
+# and BatchStatistics scores all of them in one call. cost is charged per
+# half-turn: every position is opened and closed within the day, so each leg
+# pays it twice. The scripts' own numbers are k = 10,
+# cost = 0, mix (1, 1). Nothing is retrained.
+#
+#   python sweep.py results-Intraday-240-1-RF
+#   python sweep.py results-Intraday-240-1-RF results-Intraday-240-3-RF --ks 5 10 20 --costs 0 0.0005
+
+KS = list(range(1,51))
+COSTS = [0.,0.0001,0.0002,0.0005,0.001]
+MIXES = [(1.,1.),(1.,0.),(0.,1.),(1.,0.5),(0.5,1.)]
+
+
+def daily_returns(long,short,costs=COSTS,mixes=MIXES):
+    # long, short: (days x ks) leg returns; (days x ks x costs x mixes) result
+    w = np.asarray(mixes,dtype='float64')
+    cost = 2*np.asarray(costs,dtype='float64')[:,None]*w.sum(axis=1)[None,:]
+    legs = long[:,:,None]*w[:,0]+short[:,:,None]*w[:,1]
+    return legs[:,:,None,:]-cost[None,None,:,:]
+
+
+def sweep(folder,ks=KS,costs=COSTS,mixes=MIXES,years=None,predictions=None):
+    # one row per configuration with Mean, Sharpe and MDD of its daily returns
+    p = load_predictions([folder],years) if predictions is None else predictions.select(folder)
+    if not len(p):
+        raise ValueError('no stored predictions in '+folder)
+    dates,prob,ret = p.matrices()
+    long,short = long_short(prob,ret,ks)
+    daily = daily_returns(long,short,costs,mixes)
+    # one row per configuration, k slowest and mix fastest
+    result = BatchStatistics(daily.reshape(len(daily),-1).T)
+    grid = pd.MultiIndex.from_product([ks,costs,range(len(mixes))],names=['k','Cost','mix']).to_frame(index=False)
+    w = np.asarray(mixes,dtype='float64')[grid.pop('mix')]
+    grid['Long'],grid['Short'] = w[:,0],w[:,1]
+    # a k covering every ticker makes (1, 1) flat: zero std, infinite Sharpe
+    with np.errstate(divide='ignore',invalid='ignore'):
+        grid['Mean'],grid['Sharpe'],grid['MDD'] = result.mean(),result.sharpe(),result.MDD()
+    return grid
+
+
+def run(folders,ks=KS,costs=COSTS,mixes=MIXES,years=None):
+    # sweeps every folder and writes <folder>/sweep.csv
+    predictions = load_predictions(folders,years)
+    tables = {}
+    for folder in folders:
+        table = sweep(folder,ks,costs,mixes,predictions=predictions)
+        with atomic_open(os.path.join(folder,'sweep.csv'),newline='') as handle:
+            table.to_csv(handle,index=False)
+        best = table.loc[table['Sharpe'].idxmax()]
+        print(folder,len(table),'configurations, best Sharpe',best['Sharpe'],
+              'at k =',int(best['k']),'cost =',best['Cost'],'mix =',(best['Long'],best['Short']))
+        tables[folder] = table
+    return tables
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep k, costs and long/short mix over stored predictions')
+    parser.add_argument('folders',nargs='+')
+    parser.add_argument('--ks',type=int,nargs='+',default=KS)
+    parser.add_argument('--costs',type=float,nargs='+',default=COSTS,help='per half-turn, e.g. 0.0005 = 5 bps')
+    parser.add_argument('--mixes',type=float,nargs='+',default=None,metavar='W',
+                        help='long/short weight pairs, e.g. 1 1 1 0 0 1')
+    parser.add_argument('--years',type=int,nargs=2,default=None,metavar=('FIRST','LAST'))
+    args = parser.parse_args()
+    mixes = MIXES if args.mixes is None else list(zip(args.mixes[::2],args.mixes[1::2]))
+    years = None if args.years is None else range(args.years[0],args.years[1]+1)
+    run(args.folders,args.ks,args.costs,mixes,years)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from backtest import long_short
+
+
+def reference(pred,ret,k):
+    # the per-day argsort loop long_short replaced, over the day's samples
+    out = []
+    for p,r in zip(pred,ret):
+        ok = ~np.isnan(p)
+        preds,test_returns = p[ok],r[ok]
+        top_preds = preds.argsort()[-k:][::-1]
+        worst_preds = preds.argsort()[:k][::-1]
+        out.append([np.mean(test_returns[top_preds]),np.mean(-test_returns[worst_preds])])
+    return np.array(out)
+
+
+@pytest.mark.parametrize('k',[1,3,10])
+def test_long_short_matches_the_argsort_loop(k):
+    rng = np.random.default_rng(2)
+    pred,ret = rng.random((40,25)),rng.normal(0,0.02,(40,25))
+    pred[rng.random(pred.shape) < 0.3] = np.nan
+    # days with fewer than k tickers trade all of them
+    pred[:3,2:] = np.nan
+    long,short = long_short(pred,np.where(np.isnan(pred),np.nan,ret),[k])
+    np.testing.assert_allclose(np.column_stack([long[:,0],short[:,0]]),reference(pred,ret,k),rtol=1e-12)
+
+
+def test_several_ks_at_once():
+    rng = np.random.default_rng(3)
+    pred,ret = rng.random((30,20)),rng.normal(0,0.02,(30,20))
+    pred[rng.random(pred.shape) < 0.2] = np.nan
+    long,short = long_short(pred,ret,[2,5,10])
+    for i,k in enumerate([2,5,10]):
+        one = long_short(pred,ret,[k])
+        np.testing.assert_allclose(long[:,i],one[0][:,0],rtol=1e-12)
+        np.testing.assert_allclose(short[:,i],one[1][:,0],rtol=1e-12)
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+from cache import FeatureCache
+from features import panel, close_returns, nextday_returns, shift, lag_family, window_family, build_samples, flat
+from labels import qcut_labels
+from samples import SampleStore
+
+
+def market(years=range(1990,1997),tickers=8,seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(str(years[0]),str(years[-1]+1),inclusive='left').strftime('%Y-%m-%d')
+    names = ['T%d'%i for i in range(tickers)]
+    close = np.exp(np.cumsum(rng.normal(0,0.01,(len(dates),tickers)),axis=0))
+    close[:300,5] = np.nan
+    df = pd.DataFrame(close,columns=names)
+    df.insert(0,'Date',dates)
+    return df,names
+
+
+def window(df,names,test_year):
+    # the window's frame and next-day labels ranked over its own universe,
+    # so the labels of a year differ from window to window
+    rows = df['Date'].str[:4].astype(int).between(test_year-3,test_year).to_numpy()
+    w = df[rows].reset_index(drop=True)
+    label = qcut_labels(w[names].pct_change(fill_method=None),[0.5,0.5]).shift(-1)
+    return w,label
+
+
+def rf_features(df,stock_names):
+    cl = panel(df,stock_names)
+    return [lag_family(cl,cl,[1,2,5,20,60,240])]
+
+
+def lstm_features(df,stock_names):
+    return [window_family(close_returns(panel(df,stock_names)),240)]
+
+
+def next_open_features(df,stock_names):
+    # reads the next day's row, like NextR
+    cl = panel(df,stock_names)
+    return [window_family(nextday_returns(cl,cl),240)]
+
+
+def returns(df,stock_names):
+    return shift(close_returns(panel(df,stock_names)),-1)
+
+
+def direct(w,label,names,features,layout):
+    X,t,j,future,lab = build_samples(features(w,names),returns(w,names),label[names].to_numpy(dtype='float64'))
+    return SampleStore(layout(X),t,j,future,lab,w['Date'],names)
+
+
+def assert_same(a,b):
+    assert np.array_equal(a.x,b.x)
+    assert np.array_equal(a.day,b.day) and np.array_equal(a.dates,b.dates)
+    assert np.array_equal(a.names(),b.names())
+    assert np.array_equal(a.ret,b.ret)
+    assert np.array_equal(a.label,b.label)
+
+
+def run(cache,df,names,features,layout,test_years=(1993,1994,1995),universes=None):
+    counts = []
+    for i,test_year in enumerate(test_years):
+        w,label = window(df,names,test_year)
+        tickers = names if universes is None else universes[i]
+        before = cache.hits,cache.misses
+        train = cache.samples([w],label,tickers,range(test_year-3,test_year),features,returns)
+        test = cache.samples([w],label,tickers,[test_year],features,returns)
+        expected = direct(w,label,tickers,features,layout).split(test_year)
+        assert_same(train,expected[0])
+        assert_same(test,expected[1])
+        counts.append((cache.hits-before[0],cache.misses-before[1]))
+    return counts
+
+
+def test_windows_reuse_the_shared_years(tmp_path):
+    # the first year of every window (cut look-back) and the new test year
+    # are built, the two years in between come from the cache
+    df,names = market()
+    cache = FeatureCache(str(tmp_path),'rf',flat=True)
+    assert run(cache,df,names,rf_features,flat) == [(0,4),(2,2),(2,2)]
+    cache = FeatureCache(str(tmp_path),'lstm')
+    assert run(cache,df,names,lstm_features,lambda X: X) == [(0,4),(2,2),(2,2)]
+
+
+def test_features_reading_the_next_day(tmp_path):
+    # the test year misses its following day, so it is built directly and
+    # stored by the next window
+    df,names = market()
+    cache = FeatureCache(str(tmp_path),'next',lead=1)
+    assert run(cache,df,names,next_open_features,lambda X: X) == [(0,4),(1,3),(1,3)]
+
+
+def test_universe_changes_and_price_edits(tmp_path):
+    df,names = market()
+    cache = FeatureCache(str(tmp_path),'rf',flat=True)
+    # two tickers join in 1994 and one leaves: the joiners are added to the
+    # cached years, which keep the leaver for the window that has all eight
+    assert run(cache,df,names,rf_features,flat,(1993,1994),[names[:6],names[1:]]) == [(0,4),(0,4)]
+    assert run(cache,df,names,rf_features,flat,[1994]) == [(2,2)]
+    # a corrected price rebuilds the blocks whose rows read it
+    df.loc[df['Date'] == '1993-06-01','T3'] *= 1.01
+    assert run(cache,df,names,rf_features,flat,[1995]) == [(0,4)]
+    assert run(cache,df,names,rf_features,flat,[1996]) == [(2,2)]
+
+
+def test_samples_written_into_a_memory_map(tmp_path):
+    df,names = market()
+    w,label = window(df,names,1994)
+    path = str(tmp_path/'train.npy')
+    out = lambda shape,dtype: np.lib.format.open_memmap(path,'w+',dtype,shape)
+    cache = FeatureCache(str(tmp_path),'lstm')
+    for _ in range(2):
+        train = cache.samples([w],label,names,range(1991,1994),lstm_features,returns,out)
+        assert_same(train,direct(w,label,names,lstm_features,lambda X: X).split(1994)[0])
+        assert np.array_equal(np.load(path),train.x)
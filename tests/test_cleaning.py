@@ -0,0 +1,41 @@
+import numpy as np
+import benchmark
+import shared_data
+from cleaning import PLACEHOLDERS, clean_prices
+from price_store import PriceStore, clean_store, write_store
+
+
+def fields():
+    return {'Open':np.array([[2.,5.],[3.,5.],[4.,0.]]),'Close':np.array([[2.,5.],[3.5,5.],[4.,5.]])}
+
+
+def test_open_of_three_is_a_price_by_default():
+    prices,valid = clean_prices(fields())
+    assert valid.tolist() == [[True,True],[True,True],[True,False]]
+    assert prices['Open'][1,0] == 3.
+
+
+def test_placeholders_for_legacy_data(tmp_path):
+    prices,valid = clean_prices(fields(),placeholders=PLACEHOLDERS)
+    assert not valid[1,0] and prices['Open'][1,0] == 2.
+    # a store written with a mask keeps its 3.00 open through --clean
+    folder = str(tmp_path/'prices')
+    write_store(folder,['a','b','c'],['X','Y'],fields())
+    clean_store(folder)
+    assert PriceStore(folder).field('Valid')[1,0]
+
+
+def test_nextday_label_skips_returns_off_a_filled_close(tmp_path,monkeypatch):
+    dates,names,fields,universe = benchmark.synthetic_market(6,1,listed=1,missing=0)
+    fields['Close'][800,2] = np.nan
+    monkeypatch.chdir(tmp_path)
+    write_store('data/prices',dates,names,fields)
+    benchmark.write_spxconst(universe,'data/SPXconst.csv','1990-01','1993-12')
+    benchmark.clear_caches(constituents=True)
+    try:
+        label = shared_data.nextday_label(1993)
+    finally:
+        benchmark.clear_caches(constituents=True)
+    # the filled close and the return computed from it are both unlabeled
+    assert label.iloc[799:803,2].isna().tolist() == [False,True,True,False]
+    assert label.iloc[1:,[0,1,3]].notna().all().all()
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pandas as pd
+from create_stock_data import CsvSource, TickerCache, build_store, download
+from price_store import PriceStore
+
+FIXTURE = os.path.join(os.path.dirname(__file__),'prices')
+
+
+class Source:
+    # rows for every ticker except `never`; `flaky` tickers come back empty on
+    # their first request, as yfinance returns a failed symbol
+    def __init__(self,never=(),flaky=()):
+        self.never,self.flaky = set(never),set(flaky)
+        self.calls = []
+
+    def fetch(self,tickers,start,end):
+        self.calls.append((list(tickers),start,end))
+        dates = pd.bdate_range(start,end,inclusive='left').strftime('%Y-%m-%d')
+        out = {}
+        for t in tickers:
+            if t in self.never or t in self.flaky:
+                self.flaky.discard(t)
+                continue
+            out[t] = pd.DataFrame({'Open':1.,'Close':2.},index=pd.Index(dates,name='Date'))
+        return out
+
+
+def test_empty_results_are_retried_and_not_recorded(tmp_path):
+    cache = TickerCache(str(tmp_path))
+    ranges = {t:('2000-01-01','2000-02-01') for t in 'ABC'}
+    failed = download(Source(never='C',flaky='B'),cache,ranges,workers=1,retries=2,backoff=0)
+    assert failed == [(['C'],'2000-01-01','2000-02-01')]
+    assert sorted(cache.fetched) == ['A','B']
+    assert len(cache.frame('B')) == 21
+    # the next run asks for C again
+    source = Source()
+    assert download(source,TickerCache(str(tmp_path)),ranges,workers=1,backoff=0) == []
+    assert source.calls == [(['C'],'2000-01-01','2000-02-01')]
+
+
+def test_disjoint_runs_leave_the_gap_missing(tmp_path):
+    cache = TickerCache(str(tmp_path))
+    download(Source(),cache,{'A':('2000-01-01','2009-01-01')},workers=1)
+    download(Source(),cache,{'A':('1990-01-01','1996-01-01')},workers=1)
+    cache = TickerCache(str(tmp_path))
+    assert cache.fetched['A'] == [['1990-01-01','1996-01-01'],['2000-01-01','2009-01-01']]
+    assert cache.missing('A','1990-01-01','2009-01-01') == [('1996-01-01','2000-01-01')]
+    assert cache.missing('A','1991-01-01','1995-01-01') == []
+    download(Source(),cache,{'A':('1990-01-01','2010-01-01')},workers=1)
+    assert cache.fetched['A'] == [['1990-01-01','2010-01-01']]
+
+
+def test_csv_fixture_to_price_store(tmp_path):
+    # tests/prices: BBB misses 1990-01-05, CCC lists on 1990-01-16, DDD has no file
+    cache = TickerCache(str(tmp_path/'raw'))
+    ranges = {t:('1990-01-01','1990-02-01') for t in ['AAA','BBB','CCC','DDD']}
+    failed = download(CsvSource(FIXTURE),cache,ranges,workers=1,retries=1)
+    assert failed == [(['DDD'],'1990-01-01','1990-02-01')]
+    build_store(cache,ranges,str(tmp_path/'prices'))
+    store = PriceStore(str(tmp_path/'prices'))
+    close = store.frame('Close')
+    assert list(close.columns) == ['Date','AAA','BBB','CCC']
+    assert len(close) == 22 and close['Date'].iloc[0] == '1990-01-02'
+    expected = pd.read_csv(os.path.join(FIXTURE,'AAA.csv'))['Close'].to_numpy()
+    np.testing.assert_allclose(close['AAA'].to_numpy(),expected,rtol=1e-6)
+    valid = store.frame('Valid').set_index('Date')
+    assert not valid.loc['1990-01-05','BBB'] and valid['BBB'].sum() == 21
+    assert valid['CCC'].tolist() == [False]*10+[True]*12
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+from features import (build_samples, close_returns, flat, intraday_returns, lag_family, nextday_returns, panel,
+                      select_lags, shift, window_family)
+
+# The panel builds against the per-ticker create_stock_data loops they
+# replaced (with shorter lags), on a panel with late listings and ties.
+
+LAGS = list(range(1,5))+list(range(5,21,5))
+M = 12
+
+
+def market(rows=90,tickers=5):
+    rng = np.random.default_rng(1)
+    dates = pd.bdate_range('1990-01-01',periods=rows).strftime('%Y-%m-%d')
+    names = ['T%d'%j for j in range(tickers)]
+    close = np.round(np.exp(np.cumsum(rng.normal(0,0.02,(rows,tickers)),axis=0))*20,2)
+    op = np.round(close*np.exp(rng.normal(0,0.01,(rows,tickers))),2)
+    for j in range(tickers):
+        close[:7*j,j] = op[:7*j,j] = np.nan
+    label = rng.integers(0,2,(rows,tickers)).astype('float64')
+    label[rng.random(label.shape) < 0.05] = np.nan
+    frame = lambda values: pd.concat([pd.DataFrame({'Date':dates}),pd.DataFrame(values,columns=names)],axis=1)
+    return frame(op),frame(close),pd.DataFrame(label,columns=names),names
+
+
+def reference(build,names,label):
+    # the baseline: one frame per ticker, NaN rows dropped, tickers stacked
+    rows = []
+    for st in names:
+        st_data = build(st)
+        st_data['label'] = list(label[st])
+        rows.append(st_data.dropna())
+    return pd.concat(rows,ignore_index=True)
+
+
+def check(X,t,j,ret,lab,expected,dates,names):
+    assert len(expected) > 100
+    assert list(dates[t]) == list(expected['Date'])
+    assert [names[i] for i in j] == list(expected['Name'])
+    np.testing.assert_allclose(X,expected.iloc[:,2:-2].to_numpy(dtype='float64'),rtol=1e-6)
+    np.testing.assert_array_equal(ret,expected.iloc[:,-2].to_numpy(dtype='float64'))
+    np.testing.assert_array_equal(lab,expected['label'].to_numpy(dtype='float64'))
+
+
+def test_lag_families_match_intraday_3_rf():
+    df_open,df_close,label,names = market()
+    def build(st):
+        st_data = pd.DataFrame({'Date':df_close['Date'],'Name':st})
+        daily_change = df_close[st]/df_open[st]-1
+        for k in LAGS:
+            st_data['IntraR'+str(k)] = daily_change.shift(k)
+        for k in LAGS:
+            st_data['CloseR'+str(k)] = df_close[st].pct_change(k,fill_method=None).shift(1)
+        for k in LAGS:
+            st_data['OverNR'+str(k)] = df_open[st]/df_close[st].shift(k)-1
+        st_data['R-future'] = daily_change
+        return st_data
+    op,cl = panel(df_open,names),panel(df_close,names)
+    daily_change = intraday_returns(op,cl)
+    families = [select_lags(daily_change,LAGS),lag_family(cl,cl,[k+1 for k in LAGS],num_lag=1),
+                lag_family(op,cl,LAGS)]
+    X,t,j,ret,lab = build_samples(families,daily_change,label[names].to_numpy(dtype='float64'))
+    check(flat(X),t,j,ret,lab,reference(build,names,label),df_close['Date'].to_numpy(),names)
+
+
+def test_lag_family_matches_nextday_rf():
+    _,df,label,names = market()
+    def build(st):
+        st_data = pd.DataFrame({'Date':df['Date'],'Name':st})
+        for k in LAGS:
+            st_data['R'+str(k)] = df[st].pct_change(k,fill_method=None)
+        st_data['R-future'] = df[st].pct_change(fill_method=None).shift(-1)
+        return st_data
+    cl = panel(df,names)
+    X,t,j,ret,lab = build_samples([lag_family(cl,cl,LAGS)],shift(close_returns(cl),-1),
+                                  label[names].to_numpy(dtype='float64'))
+    check(flat(X),t,j,ret,lab,reference(build,names,label),df['Date'].to_numpy(),names)
+
+
+def test_window_families_match_intraday_3_lstm():
+    df_open,df_close,label,names = market()
+    def build(st):
+        st_data = pd.DataFrame({'Date':df_close['Date'],'Name':st})
+        daily_change = df_close[st]/df_open[st]-1
+        for k in range(M)[::-1]:
+            st_data['IntraR'+str(k)] = daily_change.shift(k)
+        nextday_ret = pd.Series(list(np.array(df_open[st][1:])/np.array(df_close[st][:-1])-1)+[np.nan])
+        for k in range(M)[::-1]:
+            st_data['NextR'+str(k)] = nextday_ret.shift(k)
+        close_change = df_close[st].pct_change(fill_method=None)
+        for k in range(M)[::-1]:
+            st_data['CloseR'+str(k)] = close_change.shift(k)
+        st_data['IntraR-future'] = daily_change.shift(-1)
+        return st_data
+    op,cl = panel(df_open,names),panel(df_close,names)
+    daily_change = intraday_returns(op,cl)
+    families = [window_family(daily_change,M),window_family(nextday_returns(op,cl),M),
+                window_family(close_returns(cl),M)]
+    X,t,j,ret,lab = build_samples(families,shift(daily_change,-1),label[names].to_numpy(dtype='float64'))
+    assert X.shape[1:] == (M,3)
+    check(flat(X),t,j,ret,lab,reference(build,names,label),df_close['Date'].to_numpy(),names)
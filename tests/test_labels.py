@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+import pytest
+from labels import qcut_labels
+
+
+def reference(ret,perc):
+    # the row-wise pandas labels qcut_labels replaces; rows qcut rejects are NaN
+    q = [0.]+list(np.cumsum(perc))
+    def row(x):
+        try:
+            return pd.qcut(x.rank(method='first'),q,labels=False)
+        except ValueError:
+            return pd.Series(np.nan,index=x.index)
+    return ret.apply(row,axis=1).astype('float64')
+
+
+@pytest.mark.parametrize('perc',[[0.5,0.5],[0.1,0.8,0.1],[0.2]*5,[0.3,0.7]])
+def test_qcut_labels_match_pandas(perc):
+    rng = np.random.default_rng(0)
+    # ties from rounding, random gaps and rows with 0 to 3 valid tickers
+    ret = np.round(rng.normal(0,0.01,(60,23)),3)
+    ret[rng.random(ret.shape) < 0.2] = np.nan
+    for n in range(4):
+        ret[n,n:] = np.nan
+    ret = pd.DataFrame(ret,columns=['T%d'%j for j in range(23)])
+    label = qcut_labels(ret,perc)
+    assert label.columns.equals(ret.columns)
+    np.testing.assert_array_equal(label.to_numpy(dtype='float64'),reference(ret,perc).to_numpy())
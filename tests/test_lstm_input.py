@@ -0,0 +1,47 @@
+import os
+import numpy as np
+import pytest
+from sklearn.preprocessing import RobustScaler, StandardScaler
+from lstm_input import scale, spill, stream
+from samples import SampleStore
+
+
+def store(x):
+    n = len(x)
+    return SampleStore(x,np.arange(n),np.zeros(n),np.zeros(n),np.random.default_rng(0).integers(0,2,n),
+                       np.array(['1993-01-04']*n),np.array(['T0']))
+
+
+def test_spill_is_removed_after_the_block(tmp_path):
+    x = np.random.default_rng(0).random((100,240,1))
+    with spill(str(tmp_path/'name-train')) as target:
+        out = target.array(x.shape)
+        out[:] = x
+        data = store(out)
+        assert os.listdir(tmp_path) == [os.path.basename(target.path)]
+        assert np.shares_memory(data.x,out) and np.array_equal(data.x,x.astype('float32'))
+        assert stream(data,batch_size=32)['steps_per_epoch'] == 3
+    assert os.listdir(tmp_path) == []
+    with pytest.raises(KeyError):
+        with spill(str(tmp_path/'name-train')):
+            raise KeyError
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('scaler',[RobustScaler,StandardScaler])
+def test_chunked_scale_matches_one_scaler(tmp_path,scaler):
+    rng = np.random.default_rng(1)
+    train = (0.02*rng.standard_t(3,(5000,40,3))).astype('float32')
+    test = (0.02*rng.standard_t(3,(700,40,3))).astype('float32')
+    train[:,5,1] = 0.
+    expected = train.reshape(len(train),-1).copy(),test.reshape(len(test),-1).copy()
+    one = scaler(copy=False).fit(expected[0])
+    one.transform(expected[0])
+    one.transform(expected[1])
+    with spill(str(tmp_path/'train')) as target:
+        mapped = target.array(train.shape)
+        mapped[:] = train
+        # 4000 bytes: blocks of one column and of 8 rows
+        scale(mapped,test,scaler,chunk_bytes=4000)
+        assert np.array_equal(mapped.reshape(len(train),-1),expected[0])
+    assert np.array_equal(test.reshape(len(test),-1),expected[1])
@@ -0,0 +1,35 @@
+import json
+import numpy as np
+import pytest
+from Statistics import OnlineStatistics, Statistics
+
+EXACT = ['mean','std','stderr','pos_perc','skewness','kurtosis','MDD','sharpe']
+
+
+def series(kind,n=5000):
+    rng = np.random.default_rng(0)
+    return rng.normal(0.05,1,n) if kind == 'normal' else 0.5*rng.standard_t(3,n)
+
+
+@pytest.mark.parametrize('kind',['normal','t3'])
+def test_online_statistics_track_statistics(kind):
+    s = series(kind)
+    batch,online = Statistics(s),OnlineStatistics().extend(s)
+    for m in EXACT:
+        assert getattr(online,m)() == pytest.approx(getattr(batch,m)(),rel=1e-9)
+    # the P^2 sketch is approximate, least so in a fat (t(3)) tail
+    for c in online.confidences:
+        assert online.VaR(c) == pytest.approx(batch.VaR(c),rel=0.05)
+        assert online.CVaR(c) == pytest.approx(batch.CVaR(c),rel=0.03)
+
+
+def test_state_round_trip_through_json():
+    s = series('t3',3000)
+    whole = OnlineStatistics().extend(s)
+    first = OnlineStatistics().extend(s[:1234])
+    resumed = OnlineStatistics.from_state(json.loads(json.dumps(first.state()))).extend(s[1234:])
+    for m in EXACT:
+        assert getattr(resumed,m)() == getattr(whole,m)()
+    for c in whole.confidences:
+        assert resumed.VaR(c) == whole.VaR(c)
+        assert resumed.CVaR(c) == whole.CVaR(c)
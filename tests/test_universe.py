@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+from universe import build
+
+
+def events(rows):
+    return pd.DataFrame({'date':np.array([r[0] for r in rows],dtype='datetime64[D]'),
+                         'ticker':[r[1] for r in rows],'action':[r[2] for r in rows]})
+
+
+def test_anchor_month_is_the_anchor():
+    # B and C carry placeholder additions before the anchor but are not in
+    # it; A and D are in it, D without any event before the anchor date
+    log = events([('1900-01-01','B','added'),('1900-01-01','C','added'),
+                  ('1985-06-01','A','added'),('1992-03-02','B','added'),
+                  ('1994-05-02','A','removed'),('1995-01-03','D','removed')])
+    anchor = {'A','D'}
+    universe = build(log,anchor,'1990-01-01')
+    index = universe.index('1990-01','1990-01',at='start')
+    assert set(index.tickers[index.member[0]]) == anchor
+    assert universe.members('1990-01-01') == ['A','D']
+    assert not universe.member('C','1995-01-01')
+    assert universe.member('B','1992-03-02') and not universe.member('B','1991-12-31')
+    assert universe.members('1995-06-01') == ['B']
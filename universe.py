@@ -0,0 +1,200 @@
+import argparse
+import csv
+import numpy as np
+import pandas as pd
+from constituents import ConstituentIndex
+from outputs import atomic_open
+
+# Point-in-time S&P 500 universe from the dated add/remove events in
+# sp500_history.csv, instead of the hand-assembled data/SPXconst.csv. The log
+# only records changes, so it is anchored on one known member list: every
+# ticker's state before its first event follows from that anchor and its
+# events up to the anchor date, and the events are then replayed forward once
+# into sorted [start, end) membership intervals per ticker. On the anchor date
+# the state is set to the anchor itself, so events the log dates before it
+# (e.g. the 1900-01-01 placeholder additions) cannot make a non-member live
+# there. A ticker without events is a member throughout if it is in the
+# anchor and never otherwise.
+#
+# Default anchor: the first month of data/SPXconst.csv (the anchor list can
+# be any dated snapshot, e.g. the current list in sp500_constituents_history.csv,
+# but that one postdates the end of the event log). The result is only as
+# complete as the log: a removal missing from it keeps the ticker a member.
+#
+#   python universe.py --out data/SPXconst-events.csv --first 1990-01 --last 2018-12
+
+BEGIN = np.datetime64('0001-01-01','D')
+END = np.datetime64('9999-12-31','D')
+
+
+class Universe:
+    def __init__(self,tickers,ticker,start,end):
+        # ticker: codes into `tickers`; intervals sorted by (ticker, start)
+        self.tickers = np.asarray(tickers).astype(str)
+        self.code = {t:i for i,t in enumerate(self.tickers)}
+        self.ticker = np.asarray(ticker,dtype='int64')
+        self.start = np.asarray(start,dtype='datetime64[D]')
+        self.end = np.asarray(end,dtype='datetime64[D]')
+        self.offsets = np.searchsorted(self.ticker,np.arange(len(self.tickers)+1))
+
+    def intervals(self,ticker):
+        # [start, end) membership intervals of one ticker
+        i = self.code.get(ticker)
+        if i is None:
+            return []
+        lo,hi = self.offsets[i],self.offsets[i+1]
+        return list(zip(self.start[lo:hi],self.end[lo:hi]))
+
+    def member(self,ticker,date):
+        # binary search over the ticker's intervals
+        i = self.code.get(ticker)
+        if i is None:
+            return False
+        lo,hi = self.offsets[i],self.offsets[i+1]
+        date = np.datetime64(date,'D')
+        j = lo+np.searchsorted(self.start[lo:hi],date,side='right')-1
+        return bool(j >= lo and date < self.end[j])
+
+    def member_between(self,ticker,first,last):
+        # a member on any day of first..last, both included
+        i = self.code.get(ticker)
+        if i is None:
+            return False
+        lo,hi = self.offsets[i],self.offsets[i+1]
+        last = np.datetime64(last,'D')
+        j = lo+np.searchsorted(self.start[lo:hi],last,side='right')-1
+        return bool(j >= lo and np.datetime64(first,'D') < self.end[j])
+
+    def members(self,date):
+        date = np.datetime64(date,'D')
+        live = (self.start <= date) & (date < self.end)
+        return sorted(self.tickers[np.unique(self.ticker[live])].tolist())
+
+    def members_between(self,first,last):
+        live = (self.start <= np.datetime64(last,'D')) & (np.datetime64(first,'D') < self.end)
+        return sorted(self.tickers[np.unique(self.ticker[live])].tolist())
+
+    def mask(self,dates,tickers=None):
+        # (dates x tickers) membership; dates sorted
+        dates = np.asarray(dates,dtype='datetime64[D]')
+        steps = np.zeros((len(dates)+1,len(self.tickers)),dtype='int32')
+        np.add.at(steps,(np.searchsorted(dates,self.start),self.ticker),1)
+        np.add.at(steps,(np.searchsorted(dates,self.end),self.ticker),-1)
+        out = np.cumsum(steps,axis=0)[:-1] > 0
+        if tickers is None:
+            return out
+        cols = np.array([self.code.get(t,-1) for t in tickers],dtype='int64')
+        return np.where(cols >= 0,out[:,cols],False)
+
+    def index(self,first,last,at='end'):
+        # monthly ConstituentIndex for months first..last ('YYYY-MM'), each
+        # month holding the members on its last (or first) day
+        months = np.arange(np.datetime64(first,'M'),np.datetime64(last,'M')+1)
+        days = (months+1).astype('datetime64[D]')-1 if at == 'end' else months.astype('datetime64[D]')
+        return ConstituentIndex(months.astype(str),self.tickers,self.mask(days))
+
+
+def read_events(path='sp500_history.csv'):
+    # date, ticker, action ('added' / 'removed') in log order. Every line of
+    # the file is itself a quoted CSV record, and dates come in two formats.
+    with open(path,newline='') as f:
+        rows = [next(csv.reader([line[0]])) for line in csv.reader(f) if line]
+    df = pd.DataFrame(rows[1:],columns=rows[0])
+    return pd.DataFrame({'date':pd.to_datetime(df['date'],format='mixed').dt.normalize().to_numpy('datetime64[D]'),
+                         'ticker':df['ticker'].str.strip(),'action':df['action'].str.strip()})
+
+
+def spxconst_anchor(path='data/SPXconst.csv'):
+    # (first day of the first month, its members)
+    df = pd.read_csv(path)
+    col = min(df.columns,key=lambda c:'-'.join(c.split('/')[::-1]))
+    return np.datetime64('-'.join(col.split('/')[::-1]),'D'),set(df[col].dropna().astype(str))
+
+
+def history_anchor(path='sp500_constituents_history.csv'):
+    # (first day of the latest month, its members)
+    df = pd.read_csv(path)
+    last = df.sort_values(['Year','Month']).iloc[-1]
+    rows = df[(df['Year'] == last['Year']) & (df['Month'] == last['Month'])]
+    return np.datetime64('%04d-%02d-01'%(last['Year'],last['Month']),'D'),set(rows['Symbol'].astype(str))
+
+
+def build(events,anchor,anchor_date):
+    # events: read_events() frame, anchor: members on anchor_date
+    anchor_date = np.datetime64(anchor_date,'D')
+    events = events.sort_values('date',kind='stable')
+    tickers = sorted(set(events['ticker']) | set(anchor))
+    by_ticker = {t:[] for t in tickers}
+    for d,t,a in zip(events['date'].to_numpy('datetime64[D]'),events['ticker'],events['action']):
+        by_ticker[t].append((d,a == 'added'))
+    code,start,end = [],[],[]
+    for i,t in enumerate(tickers):
+        # state before the first event: walk back from the anchor date
+        live = t in anchor
+        for d,added in reversed([e for e in by_ticker[t] if e[0] <= anchor_date]):
+            live = not added
+        opened = BEGIN
+        anchored = False
+        for d,added in by_ticker[t]+[(END,None)]:
+            if not anchored and d > anchor_date:
+                # snap to the anchor before the first later event
+                anchored = True
+                if live and t not in anchor:
+                    if anchor_date > opened:
+                        code.append(i)
+                        start.append(opened)
+                        end.append(anchor_date)
+                    live = False
+                elif not live and t in anchor:
+                    live,opened = True,anchor_date
+            if added is None:
+                break
+            if added and not live:
+                live,opened = True,d
+            elif not added and live:
+                if d > opened:
+                    code.append(i)
+                    start.append(opened)
+                    end.append(d)
+                live = False
+        if live:
+            code.append(i)
+            start.append(opened)
+            end.append(END)
+    return Universe(tickers,code,start,end)
+
+
+def load_universe(history='sp500_history.csv',anchor=None):
+    # anchor: (date, members), by default the first month of data/SPXconst.csv
+    anchor_date,members = spxconst_anchor() if anchor is None else anchor
+    return build(read_events(history),members,anchor_date)
+
+
+def write_spxconst(universe,path,first='1990-01',last='2018-12',at='end'):
+    # the layout of data/SPXconst.csv: one column of tickers per month
+    index = universe.index(first,last,at)
+    df = pd.DataFrame({m:pd.Series(index.tickers[index.member[i]]) for i,m in enumerate(index.months)})
+    with atomic_open(path,newline='') as handle:
+        df.to_csv(handle,index=False)
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild SPXconst.csv from the S&P 500 add/remove log')
+    parser.add_argument('--history',default='sp500_history.csv')
+    parser.add_argument('--out',default='data/SPXconst-events.csv')
+    parser.add_argument('--first',default='1990-01')
+    parser.add_argument('--last',default='2018-12')
+    parser.add_argument('--at',choices=['end','start'],default='end',help='members on the last or first day of each month')
+    parser.add_argument('--anchor',choices=['spxconst','history'],default='spxconst',
+                        help='first month of data/SPXconst.csv or latest month of sp500_constituents_history.csv')
+    args = parser.parse_args()
+    anchor = spxconst_anchor() if args.anchor == 'spxconst' else history_anchor()
+    universe = load_universe(args.history,anchor)
+    # build() sets the anchor date's members to the anchor
+    if set(universe.members(anchor[0])) != anchor[1]:
+        raise ValueError('members on '+str(anchor[0])+' differ from the anchor')
+    df = write_spxconst(universe,args.out,args.first,args.last,args.at)
+    # a log missing removals shows up as a member count drifting away from 500
+    counts = df.count()
+    print(args.out,len(counts),'months,',counts.min(),'to',counts.max(),'members a month')